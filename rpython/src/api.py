@@ -0,0 +1,123 @@
+""" A library interface modelled on re, for matching from Python in the same
+    process rather than through the command line. compile returns a Pattern
+    which keeps its compiled trees between calls, resetting them before
+    each search, and patterns compiled again are taken from a cache shared
+    by every Pattern.
+
+    A search runs over the trees themselves, and Patterns with the same
+    source share their trees through _cache, so the module isn't thread
+    safe: only one search may run at a time, from one thread.
+
+    Matches are leftmost longest rather than leftmost first, and, as the
+    engine reports them, a match found by search, match, finditer or
+    findall is never empty. There are no groups, so a match's only group
+    is the whole match """
+
+from compiled import Compiled, Options, createCache
+from search import COMPLETE_MATCH, FIND_LEFTMOST_RANGE, FIND_ALL
+from parser import ReSyntaxError
+
+IGNORECASE = I = 1
+
+error = ReSyntaxError
+
+_cache = createCache(Options())
+
+
+class Match(object):
+    """ A match of pattern re in string, from start up to but not including
+        end """
+
+    def __init__(self, re, string, start, end):
+        self.re = re
+        self.string = string
+        self._start = start
+        self._end = end
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+    def span(self):
+        return (self._start, self._end)
+
+    def group(self, group=0):
+        if group != 0:
+            raise IndexError("no such group")
+        return self.string[self._start:self._end]
+
+    def __repr__(self):
+        return "<api.Match object; span=%r, match=%r>" % (self.span(), self.group())
+
+
+class Pattern(object):
+    """ A compiled pattern, which compiles its tree for each kind of search
+        the first time it's asked for one """
+
+    def __init__(self, pattern, flags):
+        if flags & ~IGNORECASE:
+            raise ValueError("Unknown flags: %d" % flags)
+        self.pattern = pattern
+        self.flags = flags
+        self.source = pattern
+        if flags & IGNORECASE:
+            self.source = "(?i)" + pattern
+        self.options = Options()
+        self.compiled = {}  # The Compiled for each mode used so far
+        self.compiledFor(COMPLETE_MATCH)  # Raises error for a bad pattern
+
+    def compiledFor(self, mode):
+        if mode not in self.compiled:
+            self.compiled[mode] = Compiled(self.source, mode, self.options, _cache)
+        return self.compiled[mode]
+
+    def run(self, mode, string, pos, endpos):
+        """ Runs the search for mode over string[pos:endpos], returning the
+            matches as (start, end) indices into string, with end
+            exclusive """
+        if endpos is None or endpos > len(string):
+            endpos = len(string)
+        pos = max(0, min(pos, endpos))
+        ans = self.compiledFor(mode).search(string[pos:endpos], -1)
+        return [(pos + a[0], pos + a[1] + 1) for a in ans if a[0] >= 0]
+
+    def search(self, string, pos=0, endpos=None):
+        """ Returns the leftmost longest match in string, or None """
+        matches = self.run(FIND_LEFTMOST_RANGE, string, pos, endpos)
+        if not matches:
+            return None
+        return Match(self, string, matches[0][0], matches[0][1])
+
+    def match(self, string, pos=0, endpos=None):
+        """ Returns the longest match at the start of string, or None """
+        m = self.search(string, pos, endpos)
+        if m is None or m.start() != pos:
+            return None
+        return m
+
+    def fullmatch(self, string, pos=0, endpos=None):
+        """ Returns a match of the whole of string, or None """
+        if endpos is None or endpos > len(string):
+            endpos = len(string)
+        pos = max(0, min(pos, endpos))
+        if self.compiledFor(COMPLETE_MATCH).search(string[pos:endpos], -1) != [(1, 0)]:
+            return None
+        return Match(self, string, pos, endpos)
+
+    def finditer(self, string, pos=0, endpos=None):
+        """ Returns an iterator over the matches FIND_ALL finds in string """
+        return iter([Match(self, string, start, end) for start, end in self.run(FIND_ALL, string, pos, endpos)])
+
+    def findall(self, string, pos=0, endpos=None):
+        """ Returns the strings matched by the matches finditer gives """
+        return [string[start:end] for start, end in self.run(FIND_ALL, string, pos, endpos)]
+
+    def __repr__(self):
+        return "api.compile(%r)" % self.pattern
+
+
+def compile(pattern, flags=0):
+    """ Compiles pattern into a Pattern. flags may be IGNORECASE """
+    return Pattern(pattern, flags)
@@ -0,0 +1,177 @@
+""" Runs a pattern over many short inputs in one process: --batch answers
+    each record of its input, and --lines greps the lines of its input """
+
+import os
+from compiled import Compiled, openCache
+from search import PARTIAL_MATCH, lineMatches
+from inputs import DEFAULT_CHUNK_SIZE
+from frames import FrameReader, writeAll
+from rpython.rlib.rstring import StringBuilder
+
+class BatchWriter(object):
+    """ Collects the answers of --batch, writing them to fd a block at a
+        time """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.out = StringBuilder()
+
+    def write(self, answer):
+        self.out.append(answer)
+        self.out.append("\n")
+        if self.out.getlength() >= DEFAULT_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        writeAll(self.fd, self.out.build())
+        self.out = StringBuilder()
+
+
+def runBatch(re, mode, inFd, outFd, options):
+    """ Runs re over each record read from inFd, writing the answer for
+        each to outFd on a line of its own. A record is a line, without its
+        newline, or a frame if options.framed is set. The pattern is
+        compiled once, and its tree reset before each record, so the JIT's
+        traces are kept from one record to the next """
+    options.jobs = 1  # Records are short, so not worth a worker each
+    compiled = Compiled(re, mode, options, openCache(options))
+    writer = BatchWriter(outFd)
+    if options.framed:
+        reader = FrameReader(inFd)
+        while True:
+            record = reader.readFrame()
+            if record is None:
+                break
+            writer.write(compiled.answer(record, -1))
+    else:
+        # The start of a line not yet ended, which is only copied once,
+        # however many chunks it spans
+        rest = StringBuilder()
+        while True:
+            chunk = os.read(inFd, options.chunkSize)
+            if len(chunk) == 0:
+                break
+            start = 0
+            while True:
+                newline = chunk.find("\n", start)
+                if newline == -1:
+                    break
+                assert newline >= 0
+                if rest.getlength() > 0:
+                    rest.append_slice(chunk, start, newline)
+                    record = rest.build()
+                    rest = StringBuilder()
+                else:
+                    record = chunk[start:newline]
+                writer.write(compiled.answer(record, -1))
+                start = newline + 1
+            rest.append_slice(chunk, start, len(chunk))
+        if rest.getlength() > 0:
+            writer.write(compiled.answer(rest.build(), -1))  # No newline at the end
+    writer.flush()
+    if options.stats:
+        compiled.reportStats()
+
+
+class LineGrep(object):
+    """ Greps blocks of whole lines for --lines, keeping the number of lines
+        matched, and the number of the next line, from block to block """
+
+    def __init__(self, re, name, outFd, options):
+        self.compiled = Compiled(re, PARTIAL_MATCH, options, openCache(options))
+        pattern = self.compiled.pattern
+        assert pattern is not None
+        pattern.reset()
+        self.pattern = pattern
+        self.name = name
+        self.options = options
+        self.writer = BatchWriter(outFd)
+        self.matched = 0
+        self.lineNumber = 1
+
+    def grep(self, s):
+        """ Writes the lines of s holding a match, each after its number if
+            options.lineNumbers is set, unless options.count or
+            options.listFiles is. s must end at the end of a line, or of
+            the input. Returns False once a line matches if
+            options.listFiles is set, as no more input need be read. The
+            tree is reset at the start of each line. Lines with no literal
+            the prefilter looks for are skipped without running it """
+        options = self.options
+        pattern = self.pattern
+        tree = pattern.tree
+        rig = self.compiled.rig
+        prefilter = pattern.prefilter
+        if prefilter is not None:
+            prefilter.reset()  # Its hits are indices into the last block
+
+        start = 0
+        while start < len(s):
+            if prefilter is not None:
+                hit = prefilter.findHit(s, start)
+                if hit == -1:
+                    if options.lineNumbers:
+                        self.lineNumber += s.count("\n", start, len(s))
+                    break
+                assert start >= 0 and hit >= 0
+                lineStart = s.rfind("\n", start, hit) + 1
+                if lineStart > start:
+                    if options.lineNumbers:
+                        self.lineNumber += s.count("\n", start, lineStart)
+                    start = lineStart
+            assert start >= 0
+            end = s.find("\n", start)
+            if end == -1:
+                end = len(s)
+            assert end >= 0
+
+            if lineMatches(tree, s, start, end, rig, pattern.startSet):
+                self.matched += 1
+                if options.listFiles:
+                    self.writer.write(self.name)
+                    return False
+                elif not options.count:
+                    if options.lineNumbers:
+                        self.writer.write("%d:%s" % (self.lineNumber, s[start:end]))
+                    else:
+                        self.writer.write(s[start:end])
+            start = end + 1
+            self.lineNumber += 1
+        return True
+
+    def finish(self):
+        """ Writes the count if options.count is set and options.listFiles,
+            which takes precedence, isn't, then flushes the lines written.
+            Returns the number of lines matched """
+        if self.options.count and not self.options.listFiles:
+            self.writer.write("%d" % self.matched)
+        self.writer.flush()
+        if self.options.stats:
+            self.compiled.reportStats()
+        return self.matched
+
+
+def grepLines(re, inFd, name, outFd, options):
+    """ Writes the lines read from inFd holding a match of re to outFd, as
+        LineGrep does, or just name if options.listFiles is set and any
+        line matches, in which case the rest of the input isn't read. The
+        input is read a chunk at a time and grepped a block of whole lines
+        at a time, so only one block is held at once """
+    grep = LineGrep(re, name, outFd, options)
+    rest = StringBuilder()  # The start of a line not yet ended
+    while True:
+        chunk = os.read(inFd, options.chunkSize)
+        if len(chunk) == 0:
+            break
+        last = chunk.rfind("\n")
+        if last == -1:
+            rest.append(chunk)
+            continue
+        rest.append_slice(chunk, 0, last + 1)
+        if not grep.grep(rest.build()):
+            return grep.finish()
+        rest = StringBuilder()
+        rest.append_slice(chunk, last + 1, len(chunk))
+    if rest.getlength() > 0:
+        grep.grep(rest.build())  # No newline at the end
+    return grep.finish()
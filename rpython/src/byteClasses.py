@@ -0,0 +1,46 @@
+""" Partitions the 256 byte values into equivalence classes: two bytes are in
+    the same class if no weight function in a pattern can tell them apart.
+    Table-driven engines then index their tables by class rather than by
+    byte, which shrinks them to the number of distinct classes """
+
+
+class ByteClasses(object):
+    """ classOf[c] is the class of byte c, and representative[k] is the
+        smallest byte in class k """
+    _imutable_fields_ = ["classOf[*]", "representative[*]", "nClasses"]
+
+    def __init__(self, classOf, representative):
+        self.classOf = classOf
+        self.representative = representative
+        self.nClasses = len(representative)
+
+
+def computeByteClasses(weightFunctions, rig):
+    """ Refines the partition of the bytes by the value each weight function
+        gives them. The position given to the weight functions is fixed, so
+        position-dependent weights don't split classes """
+    classOf = [0] * 256
+    nClasses = 1
+    seen = {}
+    for f in weightFunctions:
+        if f in seen:
+            continue  # Shared by several positions, so can't split further
+        seen[f] = None
+        split = {}
+        for c in range(256):
+            w = f.call(c, 0)
+            key = (classOf[c], w[0], w[1])
+            k = split.get(key, -1)
+            if k == -1:
+                k = len(split)
+                split[key] = k
+            classOf[c] = k
+        nClasses = len(split)
+        if nClasses == 256:
+            break
+
+    representative = [-1] * nClasses
+    for c in range(256):
+        if representative[classOf[c]] == -1:
+            representative[classOf[c]] = c
+    return ByteClasses(classOf, representative)
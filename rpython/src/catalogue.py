@@ -0,0 +1,48 @@
+""" A catalogue of named patterns whose trees are compiled, and analysed
+    for the search modes, while the binary is translated, so they're
+    prebuilt constants in it rather than parsed when it runs. The
+    catalogue file given to the target has a pattern on each line, after
+    its name and a space. Patterns are looked up by name with --named """
+
+
+class Catalogue(object):
+    """ The named patterns and their CachedPatterns, keyed as in a
+        PatternImage """
+
+    def __init__(self):
+        self.patterns = {}  # The source of each pattern, by name
+        self.compiled = {}
+
+    def add(self, name, re):
+        self.patterns[name] = re
+
+    def addPattern(self, key, pattern):
+        self.compiled[key] = pattern
+
+    def source(self, name):
+        """ Returns the pattern called name, or None """
+        return self.patterns.get(name, None)
+
+    def load(self, key):
+        """ Returns a copy of the pattern stored under key, or None. A
+            search changes the state of what it runs, so the stored
+            patterns, which are constants in the binary, are never run
+            themselves """
+        pattern = self.compiled.get(key, None)
+        if pattern is None:
+            return None
+        return pattern.copy()
+
+
+def parseCatalogue(data):
+    """ Returns the (name, pattern) pairs in the text of a catalogue file.
+        Empty lines are skipped; a line without a space is an error """
+    entries = []
+    for line in data.split("\n"):
+        if line == "":
+            continue
+        space = line.find(" ")
+        if space <= 0:
+            raise ValueError("Invalid catalogue line: %s" % line)
+        entries.append((line[:space], line[space + 1:]))
+    return entries
@@ -0,0 +1,415 @@
+""" Compiles a pattern for one of the modes, taking its trees from the
+    pattern cache, the catalogue built into the binary or an image when
+    they're there, and picks the search which runs it: the RangeFinder,
+    the loops in search, or for FIND_ALL with --jobs, the workers in
+    parallel """
+
+import os
+from parser import compileRegex, ReSyntaxError, wrapPartial
+from weightFunctions import createSingleSymbolMatch, createStartPositionMatcher, createStartEndPositionMatcher
+from rigs import BitRig, StartPositionRig, StartEndPositionRig, createRig
+from glushkov import compileGlushkov
+from shiftAnd import compileShiftAnd
+from dfa import compileLazyDFA, LazyDFA, DEFAULT_MEMORY
+from prefilter import buildPrefilter
+from startSet import buildStartSet
+from reverse import buildRangeFinder, NO_MATCH
+from simplify import Simplifier
+from patternCache import PatternCache, CachedPattern, DEFAULT_CAPACITY
+from serialize import PatternImage
+from catalogue import Catalogue, parseCatalogue
+from frames import writeAll
+from parallel import findCuts, barrierBytes, parallelSearch
+from search import nModes, PARTIAL_MATCH, COMPLETE_MATCH, FIND_LEFTMOST_START, FIND_LEFTMOST_RANGE, FIND_ALL,\
+    searchInput, searchRange
+from inputs import readFile, DEFAULT_CHUNK_SIZE
+from rpython.rlib.rstring import StringBuilder
+
+nEngines = 4
+TREE, GLUSHKOV, SHIFT_AND, DFA = range(0, nEngines)
+engineNames = {"tree": TREE, "glushkov": GLUSHKOV, "shiftand": SHIFT_AND,
+               "dfa": DFA}
+
+catalogue = Catalogue()  # Filled in by target when a catalogue is given
+processCache = PatternCache(DEFAULT_CAPACITY)  # Shared by every command run
+
+
+class UsageError(Exception):
+    """ Raised for a bad command line """
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class Options(object):
+    """ Settings given as --name=value arguments before the regex """
+    def __init__(self):
+        self.engine = TREE
+        self.dfaMemory = DEFAULT_MEMORY
+        self.stats = False
+        self.prefilter = True
+        self.skip = True
+        self.reverse = True
+        self.simplify = True
+        self.patterns = False
+        self.stream = False
+        self.chunkSize = DEFAULT_CHUNK_SIZE
+        self.jobs = 1
+        self.files = False
+        self.cacheSize = DEFAULT_CAPACITY
+        self.image = ""  # The file of compiled trees to load patterns from
+        self.writeImage = ""  # The file to compile the patterns given to
+        self.named = False  # Whether patterns are given by catalogue name
+        self.serve = False
+        self.batch = False
+        self.framed = False  # Whether --batch records are frames, not lines
+        self.lines = False  # Whether to print the lines of the input which match
+        self.count = False  # -c: print the number of lines which match instead
+        self.listFiles = False  # -l: print the input's name if a line matches
+        self.lineNumbers = False  # -n: put its number before each line
+        self.socket = ""  # The Unix socket --serve listens on, or stdin
+
+    def compileKey(self):
+        """ The settings which change how a pattern is compiled, as part of
+            its key in a PatternCache """
+        return "%d %d %d %d %d %d" % (self.engine, self.dfaMemory, self.prefilter,
+                                      self.skip, self.simplify, self.stream)
+
+    def treeKey(self):
+        """ The settings which change the compiled tree itself, as part of
+            its key in an image or the catalogue. The others only change
+            what's made from the tree once it's loaded """
+        return "%d" % self.simplify
+
+
+def prepare(ast, rig, options):
+    """ Converts a compiled tree to the engine chosen in options. The
+        boolean-only engines fall back to the tree for the other rigs """
+    if options.engine == GLUSHKOV:
+        return compileGlushkov(ast, rig)
+    elif options.engine == SHIFT_AND and isinstance(rig, BitRig):
+        return compileShiftAnd(ast, rig)
+    elif options.engine == DFA and isinstance(rig, BitRig):
+        return compileLazyDFA(ast, rig, options.dfaMemory)
+    return ast
+
+
+def compilePattern(re, rig, matchFunction, simplifier):
+    """ Compiles re, simplifying the tree unless simplifier is None """
+    ast = compileRegex(re, rig, matchFunction)
+    if simplifier is not None:
+        ast = simplifier.simplify(ast, rig)
+    return ast
+
+
+def analyseSearch(ast, rig, options, built):
+    """ Analyses a compiled tree for the search modes, before it is wrapped
+        for partial matching, returning its prefilter, which is None if
+        there's no literal to look for, and its start set, which is None
+        if skipping is turned off. Both are worked out from the tree, so
+        counted repetitions aren't unrolled. If built isn't None, it's the
+        catalogue's copy of the pattern, analysed while translating, and
+        its analyses are used rather than made again """
+    prefilter = None
+    if options.prefilter and not options.stream:  # Needs the whole input
+        if built is not None:
+            prefilter = built.prefilter
+        else:
+            prefilter = buildPrefilter(ast, rig)
+    startSet = None
+    if options.skip:
+        if built is not None:
+            startSet = built.startSet
+        else:
+            startSet = buildStartSet(ast, rig)
+        if options.engine == TREE:
+            startSet.pattern = ast
+    return prefilter, startSet
+
+
+def lookupPattern(cache, re, rig, matchFunction, matcherName, partial, options, simplifier):
+    """ Returns the pattern re compiled over rig with the weight functions
+        made by matchFunction, named matcherName, and analysed for the
+        search modes if partial is set. It's taken from the cache if it's
+        there, then from the catalogue built into the binary, along with its
+        analyses and RangeFinder, then loaded from the cache's image, and
+        only then compiled """
+    key = (re, rig.name, matcherName, partial, options.compileKey())
+    pattern = cache.get(key)
+    if pattern is None:
+        treeKey = (re, rig.name, matcherName, options.treeKey())
+        built = catalogue.load(treeKey)
+        ast = None
+        if built is not None:
+            ast = built.ast
+        elif cache.image is not None:
+            ast = cache.image.load(treeKey)
+        if ast is None:
+            ast = compilePattern(re, rig, matchFunction, simplifier)
+        pattern = CachedPattern(ast, None, None)
+        if partial:
+            pattern.prefilter, pattern.startSet = analyseSearch(ast, rig, options, built)
+        if built is not None:
+            pattern.finder = built.finder
+            pattern.noFinder = built.noFinder
+        cache.put(key, pattern)
+    return pattern
+
+
+def createCache(options):
+    """ Returns an empty PatternCache, backed by the image named in options
+        if there is one """
+    cache = PatternCache(options.cacheSize)
+    if options.image != "":
+        cache.image = PatternImage(readFile(options.image))
+        cache.imageName = options.image
+    return cache
+
+
+def openCache(options):
+    """ Returns processCache, sized and backed by the image as options
+        say, so that a pattern compiled by one command run in this process
+        is reused by the next """
+    cache = processCache
+    cache.capacity = options.cacheSize
+    if options.image == "":
+        cache.image = None
+    elif options.image != cache.imageName:
+        cache.image = PatternImage(readFile(options.image))
+    cache.imageName = options.image
+    return cache
+
+
+def compileTrees(re, keys, asts, options):
+    """ Compiles re over every rig the modes use, with options, adding each
+        tree to asts and its key, as lookupPattern gives it to an image, to
+        keys """
+    simplifier = None
+    if options.simplify:
+        simplifier = Simplifier()
+    treeKey = options.treeKey()
+    bit = compilePattern(re, BitRig(), createSingleSymbolMatch, simplifier)
+    start = compilePattern(re, StartPositionRig(), createStartPositionMatcher, simplifier)
+    startEnd = compilePattern(re, StartEndPositionRig(), createStartEndPositionMatcher, simplifier)
+    keys.append((re, BitRig.name, "single symbol", treeKey))
+    asts.append(bit)
+    keys.append((re, StartPositionRig.name, "start position", treeKey))
+    asts.append(start)
+    keys.append((re, StartEndPositionRig.name, "start end position", treeKey))
+    asts.append(startEnd)
+
+
+def buildCatalogue(filename):
+    """ Compiles the patterns in the catalogue file filename over every rig
+        the modes use, with the default options, adding them to catalogue
+        along with their analyses for the search modes and, for the
+        leftmost modes, their RangeFinder. Runs while translating, so a
+        pattern which doesn't compile stops the build """
+    options = Options()
+    for name, re in parseCatalogue(readFile(filename)):
+        if catalogue.source(name) is not None:
+            raise ValueError("Pattern %s is in the catalogue twice" % name)
+        catalogue.add(name, re)
+        keys = []
+        asts = []
+        compileTrees(re, keys, asts, options)
+        for i in range(len(keys)):
+            ast = asts[i]
+            rig = createRig(keys[i][1])
+            pattern = CachedPattern(ast, buildPrefilter(ast, rig), buildStartSet(ast, rig))
+            if isinstance(rig, BitRig) and ast.empty() == rig.zero:
+                pattern.finder = buildRangeFinder(ast, rig)
+                pattern.noFinder = pattern.finder is None
+            catalogue.addPattern(keys[i], pattern)
+
+
+def namedPattern(name):
+    """ Returns the pattern called name in the catalogue """
+    re = catalogue.source(name)
+    if re is None:
+        raise UsageError("No pattern in the catalogue is called %s" % name)
+    return re
+
+
+class Compiled(object):
+    """ A pattern compiled for one mode, which can be run over any number of
+        inputs. The compiled trees are looked up in, and added to, cache.
+        The tree for the position rigs is only compiled once an input needs
+        it, as the leftmost modes usually use a RangeFinder, unless the
+        pattern is too large for one """
+
+    def __init__(self, re, mode, options, cache):
+        if mode < 0 or mode >= nModes:
+            raise ReSyntaxError("Un recognised mode: %d" % mode)
+        self.re = re
+        self.mode = mode
+        self.options = options
+        self.cache = cache
+        self.simplifier = None
+        if options.simplify:
+            self.simplifier = Simplifier()
+
+        self.finderPattern = None
+        self.usedFinder = False
+        if (mode == FIND_LEFTMOST_START or mode == FIND_LEFTMOST_RANGE) and options.reverse:
+            pattern = self.lookup(BitRig(), createSingleSymbolMatch, "single symbol", True)
+            if pattern.ast.empty() == BitRig.zero:
+                if pattern.finder is None and not pattern.noFinder:
+                    pattern.finder = buildRangeFinder(pattern.ast, BitRig())
+                    pattern.noFinder = pattern.finder is None
+                if pattern.finder is not None:
+                    self.finderPattern = pattern
+
+        self.rig = None
+        self.pattern = None
+        self.barrier = None  # The bytes FIND_ALL can cut the input after
+        self.shards = 0  # The number of pieces the last input was cut into
+        if self.finderPattern is None:
+            self.compileTree()
+
+    def lookup(self, rig, matchFunction, matcherName, partial):
+        return lookupPattern(self.cache, self.re, rig, matchFunction, matcherName, partial, self.options, self.simplifier)
+
+    def compileTree(self):
+        """ Looks up the tree run by mainloop for the mode, preparing it for
+            the engine if it hasn't been run before """
+        mode = self.mode
+        if mode == PARTIAL_MATCH:
+            rig = BitRig()
+            pattern = self.lookup(rig, createSingleSymbolMatch, "single symbol", True)
+        elif mode == COMPLETE_MATCH:
+            rig = BitRig()
+            pattern = self.lookup(rig, createSingleSymbolMatch, "single symbol", False)
+        elif mode == FIND_LEFTMOST_START:
+            rig = StartPositionRig()
+            pattern = self.lookup(rig, createStartPositionMatcher, "start position", True)
+        else:
+            rig = StartEndPositionRig()
+            pattern = self.lookup(rig, createStartEndPositionMatcher, "start end position", True)
+            if mode == FIND_ALL and self.options.jobs > 1:
+                self.barrier = barrierBytes(pattern.ast, rig)
+
+        if pattern.tree is None:
+            ast = pattern.ast
+            if mode != COMPLETE_MATCH:
+                ast = wrapPartial(ast, rig)
+            pattern.tree = prepare(ast, rig, self.options)
+        self.rig = rig
+        self.pattern = pattern
+
+    def search(self, s, fd, out=None):
+        """ Returns the final weights found for s, or for the input streamed
+            from fd if it isn't -1, as mainloop gives them for the mode. A
+            match found by the RangeFinder is given as the weight of the
+            position rig for the mode. FIND_ALL matches streamed from fd
+            are handed to the MatchWriter out instead, if it isn't None """
+        mode = self.mode
+        finderPattern = self.finderPattern
+        if finderPattern is not None and fd == -1 and len(s) > 0:
+            # The RangeFinder can't report the empty string or run over a
+            # stream
+            self.usedFinder = True
+            if finderPattern.prefilter is not None:
+                finderPattern.prefilter.reset()
+            match = searchRange(finderPattern.finder, s, finderPattern.prefilter, mode == FIND_LEFTMOST_RANGE)
+            if match == NO_MATCH:
+                return []
+            if mode == FIND_LEFTMOST_START:
+                return [(0, match[0])]
+            return [match]
+
+        self.usedFinder = False
+        if self.pattern is None:
+            self.compileTree()
+        pattern = self.pattern
+        rig = self.rig
+        assert pattern is not None and rig is not None
+        pattern.reset()
+        tree = pattern.tree
+
+        self.shards = 1
+        if self.barrier is not None and fd == -1:
+            cuts = findCuts(s, self.barrier, self.options.jobs)
+            self.shards = len(cuts) - 1
+            if len(cuts) > 2:
+                return parallelSearch(tree, s, cuts, rig, mode, pattern.prefilter, pattern.startSet)
+
+        return searchInput(tree, s, fd, rig, mode, pattern.prefilter, pattern.startSet, self.options, out)
+
+    def answer(self, s, fd):
+        """ Returns the answer for s, or for the input streamed from fd if
+            it isn't -1, as run prints it """
+        mode = self.mode
+        ans = self.search(s, fd)
+        if mode == PARTIAL_MATCH or mode == COMPLETE_MATCH:
+            if ans == [(1, 0)]:
+                return "True"
+            return "False"
+        elif mode == FIND_LEFTMOST_START:
+            if ans == []:
+                return "-1"
+            return "%d" % ans[0][1]
+        elif mode == FIND_LEFTMOST_RANGE:
+            if ans == []:
+                return formatRange((-1, -1))
+            return formatRange(ans[0])
+        return formatMatches(ans)
+
+    def reportStats(self):
+        if self.usedFinder:
+            reportStats(self.finderPattern.ast, self.finderPattern.prefilter, None, self.simplifier)
+        else:
+            reportStats(self.pattern.tree, self.pattern.prefilter, self.pattern.startSet, self.simplifier)
+        if self.barrier is not None:
+            # Fewer shards than jobs means the input had too few barrier
+            # bytes to cut it at, and a single shard was searched here
+            os.write(2, "parallel: jobs=%d shards=%d\n" % (self.options.jobs, self.shards))
+        os.write(2, self.cache.stats())
+        if self.cache.image is not None:
+            os.write(2, self.cache.image.stats())
+
+
+def formatRange(a):
+    return "(%d, %d)" % (a[0], a[1])
+
+
+def formatMatches(matches):
+    return "[" + ", ".join([formatRange(a) for a in matches]) + "]"
+
+
+class MatchWriter(object):
+    """ Writes matches to fd as they're found, giving the same line as
+        formatMatches does for all of them """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.count = 0
+
+    def write(self, matches):
+        out = StringBuilder()
+        for a in matches:
+            if self.count == 0:
+                out.append("[")
+            else:
+                out.append(", ")
+            out.append(formatRange(a))
+            self.count += 1
+        writeAll(self.fd, out.build())
+
+    def finish(self):
+        if self.count == 0:
+            writeAll(self.fd, "[]\n")
+        else:
+            writeAll(self.fd, "]\n")
+
+
+def reportStats(ast, prefilter, startSet, simplifier):
+    """ Writes the counters kept by the simplifier, engine, prefilter and
+        start set to stderr """
+    if simplifier is not None:
+        os.write(2, simplifier.stats())
+    if isinstance(ast, LazyDFA):
+        os.write(2, ast.stats())
+    if prefilter is not None:
+        os.write(2, prefilter.stats())
+    if startSet is not None:
+        os.write(2, startSet.stats())
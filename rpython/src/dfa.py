@@ -0,0 +1,142 @@
+""" A lazily built DFA for boolean matching, along the lines of RE2's. Each
+    DFA state is a set of marked positions of the Glushkov automaton. A
+    transition is worked out by the Glushkov engine the first time it is
+    taken and then cached, so most input bytes cost a single table lookup,
+    while the number of states built is still bounded by the input length.
+    Transitions are stored per byte class rather than per byte.
+
+    The cache is given a memory budget. When adding a state would go over
+    it, every state is thrown away and the DFA carries on from the current
+    one """
+
+from rpython.rlib.jit import dont_look_inside
+from weightedRegex import Expr
+from glushkov import buildAutomaton, Glushkov
+from byteClasses import computeByteClasses
+
+DEFAULT_MEMORY = 8 << 20  # Bytes
+UNKNOWN = -1  # A transition that hasn't been computed yet
+WORD = 8
+STATE_OVERHEAD = 64
+
+
+class DFAState(object):
+    """ A set of marked positions """
+    _imutable_fields_ = ["positions[*]", "accepting"]
+
+    def __init__(self, positions, accepting):
+        self.positions = positions
+        self.accepting = accepting
+
+
+def stateKey(positions):
+    return ",".join([str(p) for p in positions])
+
+
+def stateCost(positions, key, nClasses):
+    """ An estimate of the bytes used by a state and its transitions """
+    return STATE_OVERHEAD + WORD * (nClasses + len(positions)) + len(key)
+
+
+class LazyDFA(Expr):
+    """ Runs a position automaton over the BitRig as a lazily built DFA,
+        with the same interface as the tree """
+
+    def __init__(self, automaton, rig, memoryLimit):
+        Expr.__init__(self, rig)
+        self.automaton = automaton
+        self._empty = automaton.emptyWeight
+        self.nfa = Glushkov(automaton, rig)
+        self.memoryLimit = memoryLimit
+        classes = computeByteClasses(automaton.weightFunctions, rig)
+        self.classOf = classes.classOf
+        self.nClasses = classes.nClasses
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+        self.states = []
+        self.stateIndex = {}
+        # transitions[s * nClasses + k] is the state after a byte of class k
+        self.transitions = []
+        self.memoryUsed = 0
+        self.current = self.intern([])
+
+    def flush(self):
+        self.states = []
+        self.stateIndex = {}
+        self.transitions = []
+        self.memoryUsed = 0
+        self.flushes += 1
+
+    def intern(self, positions):
+        """ Returns the index of the state for positions, adding it if
+            it's new. Adding may flush the cache """
+        key = stateKey(positions)
+        index = self.stateIndex.get(key, UNKNOWN)
+        if index != UNKNOWN:
+            return index
+
+        cost = stateCost(positions, key, self.nClasses)
+        if self.states and self.memoryUsed + cost > self.memoryLimit:
+            self.flush()
+
+        accepting = False
+        for p in positions:
+            if self.automaton.lastWeight[p] != self._rig.zero:
+                accepting = True
+
+        index = len(self.states)
+        self.states.append(DFAState(positions, accepting))
+        self.stateIndex[key] = index
+        self.transitions.extend([UNKNOWN] * self.nClasses)
+        self.memoryUsed += cost
+        return index
+
+    def shift(self, mark, c, pos):
+        k = self.classOf[c]
+        source = self.current
+        if mark == self._rig.zero:
+            target = self.transitions[source * self.nClasses + k]
+            if target != UNKNOWN:
+                self.hits += 1
+                self.current = target
+                return
+        self.computeTransition(mark, c, pos, source, k)
+
+    @dont_look_inside
+    def computeTransition(self, mark, c, pos, source, k):
+        """ Shifts c from source with the Glushkov engine, caching the
+            state reached unless a mark was shifted in, which only happens
+            at the start of a match so isn't worth caching """
+        self.misses += 1
+        self.nfa.load(self.states[source].positions, self._rig.one)
+        self.nfa.shift(mark, c, pos)
+        flushes = self.flushes
+        target = self.intern(self.nfa.activePositions())
+        if mark == self._rig.zero and flushes == self.flushes:
+            self.transitions[source * self.nClasses + k] = target
+        self.current = target
+
+    def updateFinal(self):
+        if self.states[self.current].accepting:
+            self._final = self._rig.one
+        else:
+            self._final = self._rig.zero
+        return self._final
+
+    def reset(self):
+        self.current = self.intern([])
+        self._final = self._rig.zero
+
+    def stats(self):
+        return "dfa: classes=%d states=%d hits=%d misses=%d flushes=%d memory=%d\n" % (
+            self.nClasses, len(self.states), self.hits, self.misses, self.flushes,
+            self.memoryUsed)
+
+
+def compileLazyDFA(ast, rig, memoryLimit):
+    """ Compiles the tree ast, whose rig must be the BitRig, into a LazyDFA
+        whose cache uses at most memoryLimit bytes """
+    return LazyDFA(buildAutomaton(ast, rig), rig, memoryLimit)
@@ -0,0 +1,125 @@
+""" Runs a pattern over many files for --files, the files named and those
+    below the directories named. The pattern is compiled once, and with
+    --jobs the files are shared out between worker processes """
+
+import os
+import stat
+from compiled import Compiled, openCache
+from inputs import readFile, openInput
+from parallel import startWorker, sendResults, receiveResults
+from rpython.rlib.listsort import make_timsort_class
+
+StringSort = make_timsort_class()
+TimSort = make_timsort_class()
+
+
+class SizeSort(TimSort):
+    """ Sorts (size, index) pairs, largest first """
+    def lt(self, a, b):
+        return a[0] > b[0]
+
+
+def addFiles(files, path):
+    """ Adds path to files, or if it's a directory, the files below it in
+        sorted order """
+    try:
+        st = os.stat(path)
+    except OSError:
+        files.append(path)  # Reported when it can't be read
+        return
+    if not stat.S_ISDIR(st[stat.ST_MODE]):
+        files.append(path)
+        return
+    names = os.listdir(path)
+    StringSort(names).sort()
+    for name in names:
+        addFiles(files, path + "/" + name)
+
+
+def answerFile(compiled, path, options):
+    """ Returns the line runFiles prints for the file path """
+    try:
+        if options.stream:
+            fd = openInput(path)
+            try:
+                answer = compiled.answer("", fd)
+            finally:
+                if fd > 0:
+                    os.close(fd)
+        else:
+            answer = compiled.answer(readFile(path), -1)
+    except OSError:
+        return "%s: cannot read" % path
+    return "%s: %s" % (path, answer)
+
+
+def shareFiles(files, jobs):
+    """ Returns the indices into files of the files each of jobs workers is
+        to answer. The largest files are handed out first, each to the
+        worker with the fewest bytes so far, so that the workers finish at
+        about the same time """
+    order = []
+    for k in range(len(files)):
+        try:
+            size = os.stat(files[k])[stat.ST_SIZE]
+        except OSError:
+            size = 0
+        order.append((size, k))
+    SizeSort(order).sort()
+
+    shares = [[] for w in range(jobs)]
+    loads = [0] * jobs
+    for size, k in order:
+        least = 0
+        for w in range(1, jobs):
+            if loads[w] < loads[least]:
+                least = w
+        shares[least].append(k)
+        loads[least] += size
+    return shares
+
+
+def runFiles(re, mode, paths, options):
+    """ Runs re over each file named by paths, descending into directories,
+        and prints a line for each with its path and answer, in the order
+        the files were named. The pattern is compiled once, then the files
+        are shared out between --jobs worker processes by shareFiles """
+    compiled = Compiled(re, mode, options, openCache(options))
+    files = []
+    for path in paths:
+        addFiles(files, path)
+
+    jobs = min(options.jobs, len(files))
+    if jobs <= 1:
+        for path in files:
+            print(answerFile(compiled, path, options))
+        if options.stats:
+            compiled.reportStats()
+        return
+
+    shares = shareFiles(files, jobs)
+    workers = []
+    for w in range(jobs):
+        pid, fd = startWorker()
+        if pid == 0:
+            try:
+                options.jobs = 1  # Only this worker's process for each file
+                sendResults(fd, [answerFile(compiled, files[k], options) for k in shares[w]])
+            except Exception:
+                os._exit(1)  # Its files are answered again by the parent
+            os._exit(0)
+        workers.append((pid, fd))
+
+    results = [""] * len(files)
+    for w in range(jobs):
+        pid, fd = workers[w]
+        lines = receiveResults(pid, fd)
+        share = shares[w]
+        for i in range(len(share)):
+            k = share[i]
+            if lines is None or i >= len(lines):
+                results[k] = answerFile(compiled, files[k], options)  # The worker failed
+            else:
+                results[k] = lines[i]
+    for line in results:
+        print(line)
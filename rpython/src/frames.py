@@ -0,0 +1,96 @@
+""" Strings sent through a pipe or socket as frames: the length of the
+    string in decimal and a newline, then the string itself. Used by the
+    worker processes to send their results back, and by --serve for its
+    requests and answers """
+
+import os
+from rpython.rlib.rstring import StringBuilder
+
+READ_SIZE = 1 << 16
+MAX_HEADER = 20  # No length has more digits than this
+
+
+class FrameError(Exception):
+    """ Raised for input which isn't a sequence of frames """
+    def __init__(self, msg):
+        self.msg = msg
+
+
+def encodeFrame(out, s):
+    """ Appends the frame holding s to the StringBuilder out """
+    out.append("%d\n" % len(s))
+    out.append(s)
+
+
+def writeAll(fd, data):
+    written = 0
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+
+class FrameReader(object):
+    """ Reads frames from fd as they arrive """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = ""
+        self.pos = 0  # The start of the bytes of buffer not yet read
+
+    def fill(self):
+        """ Adds the next read from fd to the buffer, returning False at
+            the end of the input """
+        read = os.read(self.fd, READ_SIZE)
+        if len(read) == 0:
+            return False
+        pos = self.pos
+        assert pos >= 0
+        self.buffer = self.buffer[pos:] + read
+        self.pos = 0
+        return True
+
+    def readFrame(self):
+        """ Returns the string in the next frame, or None if the input
+            ended before it """
+        while True:
+            newline = self.buffer.find("\n", self.pos)
+            if newline >= 0:
+                break
+            if len(self.buffer) - self.pos > MAX_HEADER:
+                raise FrameError("Invalid frame length")
+            if not self.fill():
+                if self.pos == len(self.buffer):
+                    return None
+                raise FrameError("Truncated frame")
+
+        try:
+            length = int(self.buffer[self.pos:newline])
+        except ValueError:
+            raise FrameError("Invalid frame length")
+        if length < 0:
+            raise FrameError("Invalid frame length")
+        start = newline + 1
+        end = start + length
+        if end <= len(self.buffer):
+            assert start >= 0 and end >= 0
+            self.pos = end
+            return self.buffer[start:end]
+
+        # A long frame is read straight into a buffer of its size, rather
+        # than through the buffer of unread bytes
+        out = StringBuilder(length)
+        out.append_slice(self.buffer, start, len(self.buffer))
+        needed = end - len(self.buffer)
+        self.buffer = ""
+        self.pos = 0
+        while needed > 0:
+            read = os.read(self.fd, max(needed, READ_SIZE))
+            if len(read) == 0:
+                raise FrameError("Truncated frame")
+            if len(read) > needed:
+                out.append_slice(read, 0, needed)
+                self.buffer = read
+                self.pos = needed
+                break
+            out.append(read)
+            needed -= len(read)
+        return out.build()
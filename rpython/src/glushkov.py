@@ -0,0 +1,359 @@
+""" Flattens a weighted regex tree into a Glushkov position automaton.
+    Every Sym in the tree becomes a numbered position; the structure of
+    the tree is replaced by precomputed first, last and follow sets, so
+    that shifting a symbol only touches the positions reachable from the
+    currently active ones, rather than the whole tree """
+
+from weightedRegex import *
+
+
+class Edge(object):
+    """ A weighted transition into a position """
+    _imutable_fields_ = ["target", "weight"]
+
+    def __init__(self, target, weight):
+        self.target = target
+        self.weight = weight
+
+
+# The most positions and edges an automaton built only to analyse a
+# pattern may have. The edges can grow with the square of the positions,
+# as in a chain of optional pieces such as a{0,800}
+MAX_SIZE = 1 << 16
+
+
+class AutomatonTooLarge(Exception):
+    """ Raised while building an automaton which has outgrown its size """
+
+
+class PositionAutomaton(object):
+    """ The static structure of the automaton:
+            weightFunctions: the weight function of each position
+            first: the edges taken by a mark shifted into the expression
+            follow: for each position, the edges taken by its mark
+            lastWeight: for each position, the weight it contributes to
+                        the final value (zero if it isn't a last position)
+            emptyWeight: the weight of the empty string
+    """
+
+    def __init__(self, rig, maxSize):
+        self.rig = rig
+        self.weightFunctions = []
+        self.first = []
+        self.follow = []
+        self.followSets = []  # The follow edges while they're being built
+        self.lastWeight = []
+        self.emptyWeight = rig.zero
+        self.maxSize = maxSize  # -1 if there's no limit
+        self.built = 0  # The number of positions and edges so far
+
+    def size(self):
+        return len(self.weightFunctions)
+
+    def grow(self, n):
+        self.built += n
+        if self.maxSize != -1 and self.built > self.maxSize:
+            raise AutomatonTooLarge()
+
+    def addPosition(self, sym):
+        self.grow(1)
+        self.weightFunctions.append(sym.weightFunction)
+        self.followSets.append(EdgeSet())
+        self.lastWeight.append(self.rig.zero)
+        return len(self.weightFunctions) - 1
+
+    def addFollow(self, source, target, weight):
+        edges = self.followSets[source]
+        n = len(edges.edges)
+        edges.add(self.rig, target, weight)
+        self.grow(len(edges.edges) - n)
+
+
+class EdgeSet(object):
+    """ Edges with at most one into each position, found by their target """
+
+    def __init__(self):
+        self.edges = []
+        self.slots = {}  # The index in edges of the edge into each target
+
+    def add(self, rig, target, weight):
+        """ Adds an edge. Parallel edges are merged by adding their
+            weights, which keeps the counting semirings exact """
+        if weight == rig.zero:
+            return
+        i = self.slots.get(target, -1)
+        if i == -1:
+            self.slots[target] = len(self.edges)
+            self.edges.append(Edge(target, weight))
+        else:
+            self.edges[i] = Edge(target, rig.plus(self.edges[i].weight, weight))
+
+    def addAll(self, rig, other, weight):
+        """ Adds the edges of other with their weights multiplied by weight """
+        if weight == rig.zero:
+            return
+        for e in other.edges:
+            self.add(rig, e.target, rig.mult(e.weight, weight))
+
+
+def singleEdge(rig, target):
+    edges = EdgeSet()
+    edges.add(rig, target, rig.one)
+    return edges
+
+
+def scaleEdges(rig, edges, weight):
+    """ Returns a new set of the edges with every weight multiplied by
+        weight """
+    scaled = EdgeSet()
+    scaled.addAll(rig, edges, weight)
+    return scaled
+
+
+def linkEdges(auto, lasts, firsts):
+    """ Every position in lasts can be followed by every position in firsts """
+    rig = auto.rig
+    for l in lasts.edges:
+        for f in firsts.edges:
+            auto.addFollow(l.target, f.target, rig.mult(l.weight, f.weight))
+
+
+def extendLast(rig, last, cLast, cEmpty):
+    """ Returns the last edges of a sequence with last edges last extended
+        by a child with last edges cLast and empty weight cEmpty. Both sets
+        belong to the caller, and last is added to in place if it can be,
+        so that a chain doesn't copy its last edges at every child """
+    if cEmpty == rig.zero:
+        return cLast
+    if cEmpty != rig.one:
+        last = scaleEdges(rig, last, cEmpty)
+    last.addAll(rig, cLast, rig.one)
+    return last
+
+
+def chainEdges(auto, first, last, prefixEmpty, cFirst, cLast, cEmpty):
+    """ Returns the (first, last) edges of a chain of Seqs extended by one
+        more child on the right, given the empty weight of the chain so far
+        and the edges and empty weight of the child. first is added to in
+        place """
+    rig = auto.rig
+    linkEdges(auto, last, cFirst)
+    first.addAll(rig, cFirst, prefixEmpty)
+    return first, extendLast(rig, last, cLast, cEmpty)
+
+
+def buildPositions(node, auto):
+    """ Numbers the Syms below node and fills in their follow sets.
+        Returns the (first, last) edges of node, as new EdgeSets the
+        caller may change """
+    rig = auto.rig
+
+    if isinstance(node, Sym):
+        p = auto.addPosition(node)
+        return singleEdge(rig, p), singleEdge(rig, p)
+
+    elif isinstance(node, Eps):
+        return EdgeSet(), EdgeSet()
+
+    elif isinstance(node, Seq):
+        first, last = buildPositions(node.left, auto)
+        rFirst, rLast = buildPositions(node.right, auto)
+        return chainEdges(auto, first, last, node.left.empty(), rFirst, rLast, node.right.empty())
+
+    elif isinstance(node, Alt):
+        first, last = buildPositions(node.left, auto)
+        rFirst, rLast = buildPositions(node.right, auto)
+        first.addAll(rig, rFirst, rig.one)
+        last.addAll(rig, rLast, rig.one)
+        return first, last
+
+    elif isinstance(node, SeqN):
+        first, last = EdgeSet(), EdgeSet()
+        prefixEmpty = rig.one
+        for child in node.children:
+            cFirst, cLast = buildPositions(child, auto)
+            first, last = chainEdges(auto, first, last, prefixEmpty, cFirst, cLast, child.empty())
+            prefixEmpty = rig.mult(prefixEmpty, child.empty())
+        return first, last
+
+    elif isinstance(node, AltN):
+        first, last = EdgeSet(), EdgeSet()
+        for child in node.children:
+            cFirst, cLast = buildPositions(child, auto)
+            first.addAll(rig, cFirst, rig.one)
+            last.addAll(rig, cLast, rig.one)
+        return first, last
+
+    elif isinstance(node, Count):
+        # Each copy gets its own positions, chained as a Seq would be
+        first, last = EdgeSet(), EdgeSet()
+        prefixEmpty = rig.one
+        for k in range(node.high):
+            cFirst, cLast = buildPositions(node.exp, auto)
+            e = node.copyEmpty(k)
+            first, last = chainEdges(auto, first, last, prefixEmpty, cFirst, cLast, e)
+            prefixEmpty = rig.mult(prefixEmpty, e)
+        return first, last
+
+    elif isinstance(node, Rep) or isinstance(node, Plus):
+        first, last = buildPositions(node.exp, auto)
+        linkEdges(auto, last, first)
+        return first, last
+
+    else:
+        assert isinstance(node, Question)
+        return buildPositions(node.exp, auto)
+
+
+def buildAutomaton(ast, rig, maxSize=-1):
+    """ Creates the position automaton for the tree ast. Raises
+        AutomatonTooLarge if maxSize isn't -1 and the automaton would have
+        more positions and edges than that """
+    auto = PositionAutomaton(rig, maxSize)
+    first, last = buildPositions(ast, auto)
+    auto.first = first.edges
+    auto.follow = [edges.edges for edges in auto.followSets]
+    auto.followSets = []
+    for e in last.edges:
+        auto.lastWeight[e.target] = e.weight
+    auto.emptyWeight = ast.empty()
+    return auto
+
+
+def countPositions(node):
+    """ Returns the number of positions the automaton for node would have,
+        without unrolling its counted repetitions """
+    if isinstance(node, Sym):
+        return 1
+    elif isinstance(node, Seq) or isinstance(node, Alt):
+        return countPositions(node.left) + countPositions(node.right)
+    elif isinstance(node, SeqN) or isinstance(node, AltN):
+        n = 0
+        for child in node.children:
+            n += countPositions(child)
+        return n
+    elif isinstance(node, Count):
+        return node.high * countPositions(node.exp)
+    elif isinstance(node, Rep) or isinstance(node, Plus) or isinstance(node, Question):
+        return countPositions(node.exp)
+    return 0
+
+
+def boundedAutomaton(ast, rig):
+    """ Returns the position automaton for the tree ast, or None if it
+        would be larger than MAX_SIZE. Too many positions are found before
+        anything is built, and too many edges as they're added """
+    if countPositions(ast) > MAX_SIZE:
+        return None
+    try:
+        return buildAutomaton(ast, rig, MAX_SIZE)
+    except AutomatonTooLarge:
+        return None
+
+
+class Glushkov(Expr):
+    """ Runs a position automaton with the same interface as the tree, so
+        it can be used by the main loop in any mode and with any rig. Only
+        the positions holding a non-zero mark are visited on each shift """
+
+    _imutable_fields_ = ["automaton"]
+
+    def __init__(self, automaton, rig):
+        Expr.__init__(self, rig)
+        self.automaton = automaton
+        self._empty = automaton.emptyWeight
+        n = automaton.size()
+        self.marks = [rig.zero] * n
+        self.incoming = [rig.zero] * n
+        # Position lists are preallocated and swapped, so that shifting
+        # doesn't allocate
+        self.active = [0] * n
+        self.nActive = 0
+        self.nextActive = [0] * n
+        self.touched = [0] * n
+
+    def shift(self, mark, c, pos):
+        rig = self._rig
+        auto = self.automaton
+        incoming = self.incoming
+        touched = self.touched
+        nTouched = 0
+
+        for i in range(self.nActive):
+            q = self.active[i]
+            m = self.marks[q]
+            self.marks[q] = rig.zero
+            for e in auto.follow[q]:
+                if incoming[e.target] == rig.zero:
+                    touched[nTouched] = e.target
+                    nTouched += 1
+                incoming[e.target] = rig.plus(incoming[e.target], rig.mult(m, e.weight))
+
+        if mark != rig.zero:
+            for e in auto.first:
+                if incoming[e.target] == rig.zero:
+                    touched[nTouched] = e.target
+                    nTouched += 1
+                incoming[e.target] = rig.plus(incoming[e.target], rig.mult(mark, e.weight))
+
+        active = self.nextActive
+        nActive = 0
+        for i in range(nTouched):
+            p = touched[i]
+            m = rig.mult(incoming[p], auto.weightFunctions[p].call(c, pos))
+            incoming[p] = rig.zero
+            if m != rig.zero:
+                self.marks[p] = m
+                active[nActive] = p
+                nActive += 1
+        self.nextActive = self.active
+        self.active = active
+        self.nActive = nActive
+
+    def updateFinal(self):
+        rig = self._rig
+        final = rig.zero
+        for i in range(self.nActive):
+            q = self.active[i]
+            w = self.automaton.lastWeight[q]
+            if w != rig.zero:
+                final = rig.plus(final, rig.mult(self.marks[q], w))
+        self._final = final
+        return final
+
+    def load(self, positions, mark):
+        """ Replaces the state with mark on each of positions """
+        self.reset()
+        for p in positions:
+            self.marks[p] = mark
+            self.active[self.nActive] = p
+            self.nActive += 1
+
+    def activePositions(self):
+        """ Returns the sorted positions holding a mark """
+        # An insertion sort: RPython lists have no sort, and there are
+        # usually only a few active positions
+        positions = []
+        for i in range(self.nActive):
+            p = self.active[i]
+            j = len(positions)
+            positions.append(p)
+            while j > 0 and positions[j - 1] > p:
+                positions[j] = positions[j - 1]
+                j -= 1
+            positions[j] = p
+        return positions
+
+    def copy(self):
+        return Glushkov(self.automaton, self._rig)
+
+    def reset(self):
+        for i in range(self.nActive):
+            self.marks[self.active[i]] = self._rig.zero
+        self.nActive = 0
+        self._final = self._rig.zero
+
+
+def compileGlushkov(ast, rig):
+    """ Flattens the tree ast into a position automaton """
+    return Glushkov(buildAutomaton(ast, rig), rig)
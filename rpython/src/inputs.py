@@ -0,0 +1,62 @@
+""" Reads the inputs a pattern is run over, and the files of patterns and
+    images given on the command line """
+
+import os
+import stat
+from rpython.rlib.rstring import StringBuilder
+from rpython.rlib import rmmap
+from rpython.rlib.objectmodel import we_are_translated
+
+DEFAULT_CHUNK_SIZE = 1 << 16  # Bytes read at a time by --stream and readFile
+
+
+def readFile(filename):
+    """ Returns the contents of a file. A regular file is mapped read-only
+        and copied out of the mapping in one go; anything else, such as a
+        pipe, or a file mmap refuses, is read into a single buffer """
+    fp = os.open(filename, os.O_RDONLY, 0777)
+    try:
+        st = os.fstat(fp)
+        size = st[stat.ST_SIZE]
+        # Untranslated, the mapping would be copied out a byte at a time
+        if we_are_translated() and stat.S_ISREG(st[stat.ST_MODE]) and size > 0:
+            try:
+                return mapFile(fp, size)
+            except rmmap.RMMapError:
+                pass
+            except OSError:
+                pass
+        return readAll(fp, size)
+    finally:
+        os.close(fp)
+
+
+def mapFile(fp, size):
+    """ Returns the first size bytes of the file fp, copied out of a
+        read-only mapping of it. The matcher indexes a str, so the mapping
+        isn't scanned in place, but one copy out of it costs less than
+        reading the file, which copies each chunk twice """
+    m = rmmap.mmap(fp, size, access=rmmap.ACCESS_READ)
+    try:
+        return m.getslice(0, size)
+    finally:
+        m.close()
+
+
+def readAll(fp, sizeHint):
+    """ Reads fp to the end into a buffer preallocated to sizeHint bytes """
+    builder = StringBuilder(max(sizeHint, DEFAULT_CHUNK_SIZE))
+    while True:
+        read = os.read(fp, DEFAULT_CHUNK_SIZE)
+        if len(read) == 0:
+            break
+        builder.append(read)
+    return builder.build()
+
+
+def openInput(filename):
+    """ Returns a file descriptor to stream filename from, which is stdin
+        if filename is "-" """
+    if filename == "-":
+        return 0
+    return os.open(filename, os.O_RDONLY, 0777)
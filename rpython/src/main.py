@@ -1,82 +1,287 @@
 import os
 import sys
-from parser import compileRegex, ReSyntaxError, compilePartial
-from weightFunctions import createSingleSymbolMatch, createStartPositionMatcher, createStartEndPositionMatcher
-from rigs import BitRig, StartPositionRig, StartEndPositionRig
-from rpython.rlib.jit import JitDriver
-
-jitdriver = JitDriver(reds=["i", "string", "ans", "prevAns"], greens=["mode", "r", "rig"])
-nModes = 5
-PARTIAL_MATCH, COMPLETE_MATCH, FIND_LEFTMOST_START,\
-    FIND_LEFTMOST_RANGE, FIND_ALL = range(0, nModes)
-
-
-def readFile(filename):  # A simple RPython function to read a file using file pointers
-    fp = os.open(filename, os.O_RDONLY, 0777)
-    f = ""
-    while True:
-        read = os.read(fp, 4096)
-        if len(read) == 0:
+from parser import ReSyntaxError
+from weightFunctions import createSingleSymbolMatch, createStartEndPositionMatcher
+from rigs import BitRig, StartEndPositionRig
+from simplify import Simplifier
+from patternSet import PatternSet, scan
+from serialize import ImageError, dumpImage
+from frames import FrameError, writeAll
+from compiled import UsageError, Options, engineNames, Compiled, openCache, lookupPattern, compileTrees,\
+    buildCatalogue, namedPattern, MatchWriter, formatRange, formatMatches, reportStats
+from search import PARTIAL_MATCH, COMPLETE_MATCH, FIND_LEFTMOST_START, FIND_LEFTMOST_RANGE, FIND_ALL
+from inputs import readFile, openInput
+from files import runFiles
+from batch import runBatch, grepLines
+from serve import serve
+from rpython.rlib import rsocket
+
+
+def parseOptions(argv):
+    """ Strips the options from the front of argv, returning them along with
+        the remaining arguments. A "--" argument ends the options """
+    options = Options()
+    i = 1
+    while i < len(argv) and (argv[i].startswith("--") or argv[i] in ["-c", "-l", "-n"]):
+        arg = argv[i]
+        i += 1
+        if arg == "--":
             break
-        f += read
-    os.close(fp)
-    return f
-
-
-def run(re, s, mode):
-
-    string = [(i, ord(s[i])) for i in range(len(s))]
-
-    if mode == PARTIAL_MATCH:
-        ast = compilePartial(re, BitRig(), createSingleSymbolMatch)
-        ans = mainloop(ast, string, BitRig(), mode)
-        if ans == [(1, 0)]:
-            print(True)
+        elif arg == "--lines":
+            options.lines = True
+        elif arg == "-c":
+            options.lines = True
+            options.count = True
+        elif arg == "-l":
+            options.lines = True
+            options.listFiles = True
+        elif arg == "-n":
+            options.lines = True
+            options.lineNumbers = True
+        elif arg.startswith("--engine="):
+            name = arg[len("--engine="):]
+            if name not in engineNames:
+                raise UsageError("Unknown engine: %s" % name)
+            options.engine = engineNames[name]
+        elif arg.startswith("--dfa-memory="):
+            try:
+                options.dfaMemory = int(arg[len("--dfa-memory="):])
+            except ValueError:
+                raise UsageError("Invalid DFA memory limit: %s" % arg)
+        elif arg == "--stats":
+            options.stats = True
+        elif arg == "--no-prefilter":
+            options.prefilter = False
+        elif arg == "--no-skip":
+            options.skip = False
+        elif arg == "--no-reverse":
+            options.reverse = False
+        elif arg == "--no-simplify":
+            options.simplify = False
+        elif arg == "--patterns":
+            options.patterns = True
+        elif arg == "--files":
+            options.files = True
+        elif arg == "--stream":
+            options.stream = True
+        elif arg.startswith("--chunk-size="):
+            try:
+                options.chunkSize = int(arg[len("--chunk-size="):])
+            except ValueError:
+                raise UsageError("Invalid chunk size: %s" % arg)
+            if options.chunkSize < 1:
+                raise UsageError("Invalid chunk size: %s" % arg)
+        elif arg.startswith("--jobs="):
+            try:
+                options.jobs = int(arg[len("--jobs="):])
+            except ValueError:
+                raise UsageError("Invalid number of jobs: %s" % arg)
+            if options.jobs < 1:
+                raise UsageError("Invalid number of jobs: %s" % arg)
+        elif arg == "--batch":
+            options.batch = True
+        elif arg == "--framed":
+            options.framed = True
+        elif arg == "--serve":
+            options.serve = True
+        elif arg.startswith("--socket="):
+            options.socket = arg[len("--socket="):]
+        elif arg == "--named":
+            options.named = True
+        elif arg.startswith("--image="):
+            options.image = arg[len("--image="):]
+        elif arg.startswith("--write-image="):
+            options.writeImage = arg[len("--write-image="):]
+        elif arg.startswith("--cache-size="):
+            try:
+                options.cacheSize = int(arg[len("--cache-size="):])
+            except ValueError:
+                raise UsageError("Invalid cache size: %s" % arg)
+            if options.cacheSize < 1:
+                raise UsageError("Invalid cache size: %s" % arg)
         else:
-            print(False)
+            raise UsageError("Unknown option: %s" % arg)
+
+    return options, [argv[0]] + argv[i:]
+
+
+def readPatterns(filename):
+    """ Returns the patterns in a file, one to a line. An empty line is the
+        empty pattern """
+    patterns = readFile(filename).split("\n")
+    if patterns[-1] == "":
+        patterns.pop()  # After the last newline
+    return patterns
+
+
+def writeImage(patterns, filename, options):
+    """ Compiles each of patterns over every rig the modes use, writing the
+        trees to an image in filename under the options they were compiled
+        with, so they're only loaded by runs with the same ones. Patterns
+        which don't compile are left out. Returns the number of patterns
+        written """
+    keys = []
+    asts = []
+    written = 0
+    for re in patterns:
+        try:
+            compileTrees(re, keys, asts, options)
+        except ReSyntaxError:
+            continue
+        written += 1
 
-    elif mode == COMPLETE_MATCH:
-        ast = compileRegex(re, BitRig(), createSingleSymbolMatch)
-        ans = mainloop(ast, string, BitRig(), mode)
-        if ans == [(1, 0)]:
-            print(True)
-        else:
-            print(False)
+    data = dumpImage(keys, asts)
+    fp = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+    try:
+        writeAll(fp, data)
+    finally:
+        os.close(fp)
+    return written
+
+
+def run(re, s, fd, mode, options):
+    """ Runs re over s, or over the input streamed from fd if it isn't -1,
+        printing the answer for mode """
+    compiled = Compiled(re, mode, options, openCache(options))
+    if fd != -1 and mode == FIND_ALL:
+        # Matches in a stream are written out as they're found
+        out = MatchWriter(1)
+        compiled.search(s, fd, out)
+        out.finish()
+    else:
+        print(compiled.answer(s, fd))
+    if options.stats:
+        compiled.reportStats()
+
+
+def runSet(patterns, s, mode, options):
+    """ Runs every pattern in the list patterns over s in a single scan,
+        printing a line for each, prefixed with its ID, with the answer
+        run would give for that pattern. Only the tree is used """
+
+    simplifier = None
+    if options.simplify:
+        simplifier = Simplifier()
+
+    # Each pattern gets its own copy of the tree, as a pattern may be
+    # listed twice
+    cache = openCache(options)
+    if mode == PARTIAL_MATCH or mode == COMPLETE_MATCH:
+        rig = BitRig()
+        asts = [lookupPattern(cache, re, rig, createSingleSymbolMatch, "single symbol", False,
+                              options, simplifier).ast.copy() for re in patterns]
+    elif mode == FIND_LEFTMOST_START or mode == FIND_LEFTMOST_RANGE or mode == FIND_ALL:
+        rig = StartEndPositionRig()
+        asts = [lookupPattern(cache, re, rig, createStartEndPositionMatcher, "start end position", False,
+                              options, simplifier).ast.copy() for re in patterns]
+    else:
+        raise ReSyntaxError("Un recognised mode: %d" % mode)
 
-    elif mode == FIND_LEFTMOST_START:
-        ast = compilePartial(re, StartPositionRig(), createStartPositionMatcher)
-        ans = mainloop(ast, string, StartPositionRig(), mode)
-        if ans == []:
-            print(-1)
-        else:
-            print(ans[0][1])
+    patternSet = PatternSet(asts, rig, mode != COMPLETE_MATCH)
+    answers = scan(patternSet, s, mode == FIND_ALL)
 
-    elif mode == FIND_LEFTMOST_RANGE:
-        ast = compilePartial(re, StartEndPositionRig(), createStartEndPositionMatcher)
-        ans = mainloop(ast, string, StartEndPositionRig(), mode)
-        if ans == []:
-            print((-1, -1))
+    for k in range(len(patterns)):
+        ans = answers[k]
+        if mode == PARTIAL_MATCH or mode == COMPLETE_MATCH:
+            if ans == [(1, 0)]:
+                result = "True"
+            else:
+                result = "False"
+        elif mode == FIND_LEFTMOST_START:
+            if ans == []:
+                result = "-1"
+            elif ans[0][0] < 0:
+                result = "0"  # The empty string, as the StartPositionRig gives it
+            else:
+                result = "%d" % ans[0][0]
+        elif mode == FIND_LEFTMOST_RANGE:
+            if ans == []:
+                result = formatRange((-1, -1))
+            else:
+                result = formatRange(ans[0])
         else:
-            print(ans[0])
+            result = formatMatches(ans)
+        print("%d %s" % (k, result))
 
-    elif mode == FIND_ALL:
-        ast = compilePartial(re, StartEndPositionRig(), createStartEndPositionMatcher)
-        print(mainloop(ast, string, StartEndPositionRig(), mode))
-
-    else:
-        raise ReSyntaxError("Un recognised mode: %d" % mode)
+    if options.stats:
+        reportStats(patternSet.root, None, None, simplifier)
 
 
 def entry_point(argv):
     try:
         try:
+            options, argv = parseOptions(argv)
+            if options.serve:
+                serve(options)
+                return 0
+            if options.lines:
+                if len(argv) != 3:
+                    raise UsageError("Wrong arguments: run in the form --lines [-c] [-l] [-n] re input")
+                re = argv[1]
+                if options.named:
+                    re = namedPattern(re)
+                name = argv[2]
+                if name == "-":
+                    name = "(standard input)"
+                fd = openInput(argv[2])
+                try:
+                    grepLines(re, fd, name, 1, options)
+                finally:
+                    if fd > 0:
+                        os.close(fd)
+                return 0
+            if options.batch:
+                if len(argv) != 4:
+                    raise UsageError("Wrong arguments: run in the form --batch re input mode")
+                re = argv[1]
+                if options.named:
+                    re = namedPattern(re)
+                mode = int(argv[3])
+                fd = openInput(argv[2])
+                try:
+                    runBatch(re, mode, fd, 1, options)
+                finally:
+                    if fd > 0:
+                        os.close(fd)
+                return 0
+            if options.writeImage != "":
+                if len(argv) != 2:
+                    raise UsageError("Wrong arguments: run in the form --write-image=image patterns")
+                print("%d" % writeImage(readPatterns(argv[1]), options.writeImage, options))
+                return 0
+            if options.files:
+                if len(argv) < 4:
+                    raise UsageError("Not enough arguments: run in the form --files re mode path...")
+                mode = int(argv[2])
+                print(argv[1])
+                re = argv[1]
+                if options.named:
+                    re = namedPattern(re)
+                runFiles(re, mode, argv[3:], options)
+                return 0
+
             re = argv[1]
             s = argv[2]
+            fd = -1
             if len(argv) == 4:
-                s = readFile(argv[2])
+                if options.stream and not options.patterns:
+                    s = ""
+                    fd = openInput(argv[2])
+                else:
+                    s = readFile(argv[2])
             mode = int(argv[3])
             print(re)
-            run(re, s, mode)
+            if options.patterns:
+                patterns = readPatterns(re)
+                if options.named:
+                    patterns = [namedPattern(name) for name in patterns]
+                runSet(patterns, s, mode, options)
+            else:
+                if options.named:
+                    re = namedPattern(re)
+                run(re, s, fd, mode, options)
+            if fd > 0:
+                os.close(fd)
 
         except IndexError:
             print("Not enough arguments: run in the form re file mode")
@@ -85,70 +290,53 @@ def entry_point(argv):
         print("Invalid mode option")
         return 1
     except ReSyntaxError as e:
+        print(e.msg)
         print("Syntax error")
         return 0
+    except UsageError as e:
+        print(e.msg)
+        return 1
+    except ImageError as e:
+        print(e.msg)
+        return 1
+    except FrameError as e:
+        print(e.msg)
+        return 1
+    except rsocket.SocketError as e:
+        print(e.get_msg())
+        return 1
 
     return 0
 
 
-def target(*args):
+def target(driver, args):
+    """ Builds the patterns in the file named by a --catalogue=file
+        argument into the binary """
+    for arg in args:
+        if not arg.startswith("--catalogue="):
+            targetUsage("Unknown target option: %s" % arg)
+        filename = arg[len("--catalogue="):]
+        try:
+            buildCatalogue(filename)
+        except OSError as e:
+            targetUsage("Can't read catalogue %s: %s" % (filename, os.strerror(e.errno)))
+        except ValueError as e:
+            targetUsage(str(e))
+        except ReSyntaxError as e:
+            targetUsage("Pattern in catalogue %s doesn't compile: %s" % (filename, e.msg))
     return entry_point, None
 
 
+def targetUsage(msg):
+    """ Stops the build with msg and the target's usage """
+    sys.stderr.write("%s\nUsage: rpython [rpython options] main.py [--catalogue=file]\n" % msg)
+    sys.exit(2)
+
+
 def jitpolicy(driver):
     from rpython.jit.codewriter.policy import JitPolicy
     return JitPolicy()
 
-
-def mainloop(r, string, rig, mode):
-    """ Returns if string matches the regex r """
-
-    if string == []:
-        return [r.empty()]
-
-    r.shift(rig.one, string[0])  # Want to shift in an initial mark to start the
-    # NFA
-
-    i = 0
-    ans = []
-    prevAns = rig.zero
-
-    while i < len(string) - 1:  # Main program loop
-
-        jitdriver.can_enter_jit(mode=mode, r=r, rig=rig, i=i, prevAns=prevAns, string=string,  ans=ans)
-        jitdriver.jit_merge_point(mode=mode, r=r, rig=rig, i=i, prevAns=prevAns, string=string,  ans=ans)
-
-        r.updateFinal()  # Explicitly call update here, cache the values
-    #    print((i+1, "%s" % chr(string[i+1][1]), r.final()))
-
-        if mode == FIND_ALL:
-            r.updateFinal()
-            # Maybe be faster to use all?
-            if r.final() == prevAns and prevAns[0] >= 0: # I.e. prevAns != zero or one
-                # The longest leftmost match has been found. Reset FSM and start
-                # from the character at the end of the match
-
-                ans.append(r.final())
-                r.reset()
-                r.shift(rig.one, string[i])
-                prevAns = rig.zero
-            else:
-                prevAns = r.final()
-                r.shift(rig.zero, string[i+1])
-                i += 1
-
-        else:
-            r.updateFinal()
-            r.shift(rig.zero, string[i+1])
-            i += 1
-
-    # TODO:  Find a way to use fewer conditions
-    r.updateFinal()
-    if r.final()[0] >= 0:
-        ans.append(r.final())
-
-    return ans
-
 # TODO:
     # Clean up main loop -
     # Sort out {} bug -
@@ -0,0 +1,143 @@
+""" Splits a FIND_ALL search over worker processes. The input is cut into
+    shards just after barrier bytes, which no position of the pattern
+    accepts. Shifting one in clears every mark, so no match crosses a cut,
+    and a search started fresh after it is in the same state as the
+    sequential search, which gives the same matches. Each shard is searched
+    in a forked child, which writes its matches back through a pipe. An
+    input with too few barrier bytes is cut into fewer shards than there
+    are jobs, and one with none is searched sequentially; --stats reports
+    the number of shards used """
+
+import os
+from rpython.rlib.rstring import StringBuilder
+from frames import encodeFrame, writeAll
+from startSet import acceptedByTree
+from search import search
+
+DONE = "done\n"  # Written after the last match, so a crashed worker is seen
+
+
+def findCuts(s, barrier, shards):
+    """ Returns the positions at which to cut s into at most shards
+        non-empty pieces, starting with 0 and ending with len(s). There
+        may be fewer pieces if s has too few barrier bytes """
+    cuts = [0]
+    for k in range(1, shards):
+        i = max(len(s) * k // shards, cuts[len(cuts) - 1])
+        while i < len(s) and not barrier[ord(s[i])]:
+            i += 1
+        if i + 1 < len(s) and i + 1 > cuts[len(cuts) - 1]:
+            cuts.append(i + 1)
+    cuts.append(len(s))
+    return cuts
+
+
+def startWorker():
+    """ Forks a worker, returning its pid and its end of the pipe between
+        them. The pid is 0 in the worker itself """
+    readFd, writeFd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(readFd)
+        return 0, writeFd
+    os.close(writeFd)
+    return pid, readFd
+
+
+def sendResults(fd, results):
+    """ Writes a list of strings to fd from a worker, each as a frame, then
+        closes it. The worker must then exit with status 0, or
+        receiveResults takes it to have failed """
+    out = StringBuilder()
+    for result in results:
+        encodeFrame(out, result)
+    out.append(DONE)
+    writeAll(fd, out.build())
+    os.close(fd)
+
+
+def receiveResults(pid, fd):
+    """ Reads the strings written by the worker pid to fd and waits for it
+        to exit. Returns None if the worker failed """
+    out = StringBuilder()
+    while True:
+        read = os.read(fd, 1 << 16)
+        if len(read) == 0:
+            break
+        out.append(read)
+    os.close(fd)
+    data = out.build()
+    _, status = os.waitpid(pid, 0)
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0 or not data.endswith(DONE):
+        return None
+
+    stop = len(data) - len(DONE)
+    results = []
+    pos = 0
+    while pos < stop:
+        newline = data.find("\n", pos, stop)
+        if newline == -1:
+            return None
+        assert newline >= 0
+        start = newline + 1
+        end = start + int(data[pos:newline])
+        if end < start or end > stop:
+            return None
+        assert end >= 0
+        results.append(data[start:end])
+        pos = end
+    return results
+
+
+def sendMatches(fd, matches):
+    """ Writes the matches a worker found to fd, as sendResults does """
+    sendResults(fd, ["%d %d" % (m[0], m[1]) for m in matches])
+
+
+def receiveMatches(pid, fd):
+    """ Reads the matches written by the worker pid to fd, or returns None
+        if it failed """
+    results = receiveResults(pid, fd)
+    if results is None:
+        return None
+    matches = []
+    for result in results:
+        fields = result.split(" ")
+        matches.append((int(fields[0]), int(fields[1])))
+    return matches
+
+
+def barrierBytes(ast, rig):
+    """ The bytes no position of the tree ast accepts """
+    return [not a for a in acceptedByTree(ast, rig)]
+
+
+def parallelSearch(r, s, cuts, rig, mode, prefilter, startSet):
+    """ Runs search over each shard of s between consecutive cuts in its
+        own worker process, returning the matches in order. A shard whose
+        worker fails is searched again here """
+    workers = []
+    for k in range(len(cuts) - 1):
+        pid, fd = startWorker()
+        if pid == 0:
+            try:
+                r.reset()
+                sendMatches(fd, search(r, s, cuts[k], cuts[k + 1], rig, mode, prefilter, startSet))
+            except Exception:
+                os._exit(1)  # The shard is searched again by the parent
+            os._exit(0)
+        workers.append((pid, fd))
+
+    ans = []
+    for k in range(len(workers)):
+        pid, fd = workers[k]
+        matches = receiveMatches(pid, fd)
+        if matches is None:
+            r.reset()
+            if prefilter is not None:
+                # Its hits are ahead of this shard, as it looks past the
+                # end of the last one for the next window
+                prefilter.reset()
+            matches = search(r, s, cuts[k], cuts[k + 1], rig, mode, prefilter, startSet)
+        ans.extend(matches)
+    return ans
@@ -12,14 +12,59 @@ ESCAPED_SQUARE = -4
 class ReSyntaxError(Exception):
     """ Simple class for a syntax error """
     def __init__(self, msg):
-        print(msg)
+        self.msg = msg  # Printed by entry_point
     #    Exception.__init__(self, msg)  # Doesn't work in RPython?
 
+class PieceStack(object):
+    """ The pieces parsed so far. A chain of concatenations, or of
+        alternations, is kept as the list of its children until it's
+        popped, so that its SeqN or AltN is built once from the whole list
+        rather than grown a child at a time """
+
+    def __init__(self, rig):
+        self.rig = rig
+        self.pieces = []
+        self.chains = []  # The children of each piece that is a chain, or None
+        self.isSeq = []  # Whether each chain is of concatenations
+
+    def size(self):
+        return len(self.pieces)
+
+    def push(self, piece):
+        self.pieces.append(piece)
+        self.chains.append(None)
+        self.isSeq.append(False)
+
+    def pop(self):
+        piece = self.pieces.pop()
+        chain = self.chains.pop()
+        isSeq = self.isSeq.pop()
+        if chain is None:
+            return piece
+        if isSeq:
+            return SeqN(chain, self.rig)
+        return AltN(chain, self.rig)
+
+    def join(self, isSeq):
+        """ Replaces the top two pieces by their concatenation if isSeq is
+            set, or else their alternation, extending the lower one if it's
+            already a chain of the same kind """
+        right = self.pop()
+        chain = self.chains[-1]
+        if chain is not None and self.isSeq[-1] == isSeq:
+            chain.append(right)
+            return
+        left = self.pop()
+        self.pieces.append(None)
+        self.chains.append([left, right])
+        self.isSeq.append(isSeq)
+
+
 def post2WExprTree(expr, rig, symGeneratingFunction, partialCompilation):
     """ Creates the (weighted) syntax tree from a postfix
         expression
     """
-    pieceStack = []
+    pieceStack = PieceStack(rig)
     caseInsensitive = False
 
     if not expr:
@@ -29,29 +74,27 @@ def post2WExprTree(expr, rig, symGeneratingFunction, partialCompilation):
             sym = expr.pop()
 
             if sym == CONCAT_MARKER:  # Concat
-                expr2 = pieceStack.pop()
-                expr1 = pieceStack.pop()
-                pieceStack.append(Seq(expr1, expr2, rig))
+                pieceStack.join(True)
 
             elif sym == ord("|"):  # Alternate
-                pieceStack.append(Alt(pieceStack.pop(), pieceStack.pop(), rig))
+                pieceStack.join(False)
 
             elif sym == ord("*"):  # Zero or more
                 prevPiece = pieceStack.pop()
                 if isinstance(prevPiece, Rep):
                     raise ReSyntaxError("* Repetition")
                 else:
-                    pieceStack.append(Rep(prevPiece, rig))
+                    pieceStack.push(Rep(prevPiece, rig))
 
             elif sym == ord("+"):  # One or more
                 prevPiece = pieceStack.pop()
                 if isinstance(prevPiece, Plus):
                     raise ReSyntaxError("+ Repetition")
                 else:
-                    pieceStack.append(Plus(prevPiece, rig))
+                    pieceStack.push(Plus(prevPiece, rig))
 
             elif sym == ord("?"):  # Zero or one
-                pieceStack.append(Question(pieceStack.pop(), rig))
+                pieceStack.push(Question(pieceStack.pop(), rig))
 
             elif sym == ord("{"):  # Repetition count
                 frontN = -expr.pop()
@@ -60,15 +103,11 @@ def post2WExprTree(expr, rig, symGeneratingFunction, partialCompilation):
                     # repeat exactly frontN times
                     if frontN == 0:
                         pieceStack.pop()
-                        pieceStack.append(Eps(rig))
-                    elif frontN == 1:
+                        pieceStack.push(Eps(rig))
+                    elif frontN <= 1:
                         pass  # Correct?
                     else:
-                        repeatingExpr = pieceStack.pop()
-                        chain = repeatingExpr
-                        for _ in range(frontN - 1):
-                            chain = Seq(repeatingExpr.copy(), chain, rig)
-                        pieceStack.append(chain)
+                        pieceStack.push(createCount(pieceStack.pop(), frontN, frontN, rig))
 
                 else:  # expr.pop() == ","
                     endN = expr.pop()
@@ -76,26 +115,17 @@ def post2WExprTree(expr, rig, symGeneratingFunction, partialCompilation):
                         # repeat endN or more times
                         if frontN != 0:
                             repeatingExpr = pieceStack.pop()
-                            chain = repeatingExpr
-                            for _ in range(frontN - 1):
-                                chain = Seq(repeatingExpr.copy(), chain, rig)
-                            pieceStack.append(Seq(chain,  Rep(repeatingExpr.copy(), rig), rig))
+                            chain = createCount(repeatingExpr, max(frontN, 1), max(frontN, 1), rig)
+                            pieceStack.push(Seq(chain,  Rep(repeatingExpr.copy(), rig), rig))
                         else:
-                            pieceStack.append(Rep(pieceStack.pop(), rig))
+                            pieceStack.push(Rep(pieceStack.pop(), rig))
                     else:
                         # repeat between frontN and endN times
                         endN = -endN
-                        repeatingExpr = pieceStack.pop()
-                        chain = repeatingExpr if frontN > 0 else Eps(rig)
-
-                        for _ in range(frontN - 1):
-                            chain = Seq(repeatingExpr.copy(), chain, rig)
-
-                        for _ in range(endN - frontN):
-                            chain = Seq(chain, Question(repeatingExpr.copy(), rig), rig)
-
+                        low = max(frontN, 0)
+                        high = low + max(endN - frontN, 0)
                         expr.pop()  # Discard the "{"
-                        pieceStack.append(chain)
+                        pieceStack.push(createCount(pieceStack.pop(), low, high, rig))
 
             elif sym == ord("["):  # Character class
                 classExp = []
@@ -106,48 +136,49 @@ def post2WExprTree(expr, rig, symGeneratingFunction, partialCompilation):
                         break
                     classExp.append(token)
 
-                classWeightFunction = generateCharacterClass(classExp, rig, symGeneratingFunction, caseInsensitive)
-                pieceStack.append(Sym(classWeightFunction, rig))
+                classWeightFunction = generateCharacterClass(classExp, rig, caseInsensitive)
+                pieceStack.push(Sym(classWeightFunction, rig))
 
             elif sym == ord("\\"):  # Escapes - character classes built at post conversion phase
                 sym = expr.pop()
-                pieceStack.append(Sym(symGeneratingFunction(sym, rig), rig, chr(sym)))
+                pieceStack.push(Sym(symGeneratingFunction(sym, rig), rig, chr(sym)))
 
             elif sym == ord("."):  # "." matches everything except \n
-               pieceStack.append(Sym(AllButNewLineMatcher(rig), rig, "."))
+               pieceStack.push(Sym(AllButNewLineMatcher(rig), rig, "."))
 
             elif sym == EPS_MARKER:
-                pieceStack.append(Eps(rig))
+                pieceStack.push(Eps(rig))
 
             elif sym == CASE_INSENSITIVE:
                 caseInsensitive = True
 
             else:  # Literal symbols
                 if caseInsensitive:
-                    pieceStack.append(Sym(CaseInsensitiveWrapper(symGeneratingFunction(ord(chr(sym).lower()),
+                    pieceStack.push(Sym(CaseInsensitiveWrapper(symGeneratingFunction(ord(chr(sym).lower()),
                                       rig), rig), rig, chr(sym) + "CASE_INSENSITIVE"))
                 else:
-                    pieceStack.append(Sym(symGeneratingFunction(sym, rig), rig, chr(sym)))
+                    pieceStack.push(Sym(symGeneratingFunction(sym, rig), rig, chr(sym)))
 
-        if len(pieceStack) != 1:
+        if pieceStack.size() != 1:
             raise ReSyntaxError("Syntax Error: Incorrect number of operands")
 
-        return pieceStack[0]
+        return pieceStack.pop()
 
     except IndexError:
         # TODO: Break errors into more specific cases
         raise ReSyntaxError("Compilation error")
 
 
-def generateCharacterClass(classExp, rig, symGeneratingFunction, caseInsensitive):
-    """ Generates a list of chars based off of classExp. Note that there is
-        a potential of duplication of characters. This can affect things when
-        using a weighted automata, by e.g. giving two ways for "a" to match
-        [aa-z]  with the standard int semiring """
+def generateCharacterClass(classExp, rig, caseInsensitive):
+    """ Generates a weight function for the class described by classExp,
+        as a table saying which of the 256 byte values are members. The
+        inversion and case insensitivity are folded into the table, so
+        testing a symbol is a single lookup. A character listed twice,
+        e.g. "a" in [aa-z], is only a member once """
 
     if classExp == []:
         raise ReSyntaxError("Invalid character class")
-    characterClass = []
+    members = [False] * 256
     classExp = classExp
 
     invert = False
@@ -162,38 +193,39 @@ def generateCharacterClass(classExp, rig, symGeneratingFunction, caseInsensitive
                 lowerBound = classExp.pop()
                 if lowerBound == ord("^"):  # Literal -, invert
                     invert = True
-                    characterClass.append(ord("-"))
-                    characterClass.append(upperBound)
+                    members[ord("-")] = True
+                    members[upperBound] = True
                 else:
                     if upperBound < lowerBound:
                         raise ReSyntaxError("Invalid Character class")
                     # TODO: This approach will probably only work for a limited
                     #       set of characters... i.e. ascii
                     for i in range(lowerBound, upperBound + 1):
-                        characterClass.append(i)
+                        members[i] = True
             except IndexError:  # A literal "-"
-                characterClass.append(token)
+                members[token] = True
                 if upperBound != -1 and upperBound != ord("^"):
-                    characterClass.append(upperBound)
+                    members[upperBound] = True
                 elif upperBound == ord("^"):
                     invert = True
 
         elif token == ESCAPED_SQUARE:
-            characterClass.append(ord("]"))
+            members[ord("]")] = True
         elif token == ord("^"):
             invert = True
         else:
-            characterClass.append(token)
+            members[token] = True
 
-    classFunctions = [symGeneratingFunction(c, rig) for c in characterClass]
-    if caseInsensitive:
-        classFunctions = [CaseInsensitiveWrapper(o, rig) for o in classFunctions]
-
-    classWeightFunction = SymbolClassMatch(classFunctions, rig)
-    if invert:
-        classWeightFunction = InvertWrapper(classWeightFunction, rig)
+    table = [False] * 256
+    for c in range(256):
+        if caseInsensitive:
+            table[c] = members[ord(chr(c).lower())]
+        else:
+            table[c] = members[c]
+        if invert:
+            table[c] = not table[c]
 
-    return classWeightFunction
+    return ClassTableMatch(table, rig)
 
 
 def insertConcats(regExp):
@@ -392,6 +424,12 @@ def compilePartial(exp, rig, matchFunction):
     """ Creates a regex tree which will accept partial matches """
 
     ast = post2WExprTree(regexToPost(exp), rig, matchFunction, True)
+    return wrapPartial(ast, rig)
+
+
+def wrapPartial(ast, rig):
+    """ Surrounds a compiled tree with loops accepting anything, so that
+        it matches anywhere in a string """
 
     arbStart = Rep(Sym(OneProducer(rig), rig, "arb - start"), rig)
     ast = Seq(arbStart, ast, rig)
@@ -0,0 +1,93 @@
+""" A least recently used cache of compiled patterns, so that a pattern used
+    again is neither re-parsed nor re-analysed. Patterns are keyed by their
+    source, the rig and matcher they were compiled for, whether they were
+    compiled for partial matching and the options which change how they're
+    compiled, so patterns compiled with different options can share one """
+
+DEFAULT_CAPACITY = 64
+
+
+class CachedPattern(object):
+    """ A compiled pattern:
+            ast: the tree, before it is wrapped for partial matching
+            prefilter, startSet: as built by compileSearch, or None
+            tree: the tree prepared for mainloop, or None until it's needed
+            finder: the RangeFinder for the tree, or None until it's needed
+            noFinder: set once the tree is found too large for a finder
+    """
+
+    def __init__(self, ast, prefilter, startSet):
+        self.ast = ast
+        self.prefilter = prefilter
+        self.startSet = startSet
+        self.tree = None
+        self.finder = None
+        self.noFinder = False
+
+    def copy(self):
+        """ Returns a copy with its own state, and no tree prepared """
+        pattern = CachedPattern(self.ast.copy(), None, None)
+        if self.prefilter is not None:
+            pattern.prefilter = self.prefilter.copy()
+        if self.startSet is not None:
+            pattern.startSet = self.startSet.copy()
+        if self.finder is not None:
+            pattern.finder = self.finder.copy()
+        pattern.noFinder = self.noFinder
+        return pattern
+
+    def reset(self):
+        """ Clears the state left by the last search """
+        if self.tree is not None:
+            self.tree.reset()
+        if self.prefilter is not None:
+            self.prefilter.reset()
+
+
+class PatternCache(object):
+    """ Holds up to capacity CachedPatterns, evicting the one used least
+        recently when it's full """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.image = None  # The PatternImage missing patterns are loaded from
+        self.imageName = ""  # The file it was read from
+        self.entries = {}
+        self.order = []  # The keys, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ Returns the pattern stored under key, reset ready for reuse, or
+            None """
+        entry = self.entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touch(key)
+        entry.reset()
+        return entry
+
+    def put(self, key, entry):
+        if key in self.entries:
+            self.touch(key)
+        else:
+            while len(self.order) >= self.capacity:
+                del self.entries[self.order.pop(0)]
+                self.evictions += 1
+            self.order.append(key)
+        self.entries[key] = entry
+
+    def touch(self, key):
+        """ Marks key as the most recently used """
+        for i in range(len(self.order)):
+            if self.order[i] == key:
+                del self.order[i]
+                break
+        self.order.append(key)
+
+    def stats(self):
+        return "cache: size=%d hits=%d misses=%d evictions=%d\n" % (
+            len(self.order), self.hits, self.misses, self.evictions)
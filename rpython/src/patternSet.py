@@ -0,0 +1,110 @@
+""" Matches several patterns in one scan. The patterns are compiled into the
+    branches of one AltN below a shared loop accepting anything, so each
+    symbol is read once however many patterns there are. The ID of a
+    pattern is the index of its branch, and the final weight of each branch
+    says whether, and where, its pattern has matched """
+
+from weightedRegex import *
+from weightFunctions import OneProducer
+from rpython.rlib.jit import JitDriver
+
+setDriver = JitDriver(reds=["i", "s", "answers", "prevAns"], greens=["findAll", "patterns"])
+
+
+class PatternSet(object):
+    """ The tree for a list of compiled patterns. If partial is set, the
+        patterns match anywhere in a string, as with wrapPartial """
+    _imutable_fields_ = ["root", "branches[*]"]
+
+    def __init__(self, asts, rig, partial):
+        self.rig = rig
+        self.branches = []
+        for ast in asts:
+            if partial:
+                arbEnd = Rep(Sym(OneProducer(rig), rig, "arb - end"), rig)
+                ast = Seq(ast, arbEnd, rig)
+            self.branches.append(ast)
+
+        root = AltN(self.branches, rig)
+        if partial:
+            arbStart = Rep(Sym(OneProducer(rig), rig, "arb - start"), rig)
+            root = Seq(arbStart, root, rig)
+        self.root = root
+
+
+def scan(patterns, s, findAll):
+    """ Runs every pattern over s, returning for each pattern ID the
+        answers mainloop would give for that pattern alone. With findAll,
+        each branch is restarted after its own matches, as mainloop does
+        for the whole tree in FIND_ALL mode """
+    rig = patterns.rig
+    root = patterns.root
+    branches = patterns.branches
+
+    if len(s) == 0:
+        return [[b.empty()] for b in branches]
+
+    root.reset()
+    root.shift(rig.one, ord(s[0]), 0)
+
+    i = 0
+    answers = [[] for b in branches]
+    prevAns = [rig.zero] * len(branches)
+
+    while i < len(s) - 1:
+
+        setDriver.can_enter_jit(findAll=findAll, patterns=patterns, i=i, s=s, answers=answers, prevAns=prevAns)
+        setDriver.jit_merge_point(findAll=findAll, patterns=patterns, i=i, s=s, answers=answers, prevAns=prevAns)
+
+        root.updateFinal()
+
+        if findAll:
+            for k in range(len(branches)):
+                b = branches[k]
+                if b.final() == prevAns[k] and prevAns[k][0] >= 0:
+                    # This pattern's longest leftmost match has been found,
+                    # so only its branch starts again from this symbol
+                    answers[k].append(b.final())
+                    b.reset()
+                    b.shift(rig.one, ord(s[i]), i)
+                    prevAns[k] = b.updateFinal()
+                else:
+                    prevAns[k] = b.final()
+
+        root.shift(rig.zero, ord(s[i+1]), i + 1)
+        i += 1
+
+    for k in range(len(branches)):
+        finishBranch(branches[k], s, rig, findAll, answers[k])
+
+    return answers
+
+
+def finishBranch(branch, s, rig, findAll, answers):
+    """ Adds the final weight of branch after the last symbol of s to
+        answers. With findAll that match may end before the last symbol, so
+        the branch is run again on its own over the symbols after it, with
+        a mark shifted in at each as the set's loop would """
+    while True:
+        final = branch.updateFinal()
+        if final[0] < 0:
+            return
+        answers.append(final)
+        i = final[1] + 1
+        if not findAll or i >= len(s):
+            return
+
+        branch.reset()
+        branch.shift(rig.one, ord(s[i]), i)
+        prevAns = rig.zero
+        while i < len(s) - 1:
+            final = branch.updateFinal()
+            if final == prevAns and prevAns[0] >= 0:
+                answers.append(final)
+                branch.reset()
+                branch.shift(rig.one, ord(s[i]), i)
+                prevAns = rig.zero
+            else:
+                prevAns = final
+                branch.shift(rig.one, ord(s[i + 1]), i + 1)
+                i += 1
@@ -0,0 +1,252 @@
+""" A prefilter for the search modes. The compiled tree is analysed for a set
+    of literals, one of which every match must contain, and for the barrier
+    bytes which no Sym in the tree accepts, so which can't be part of a match.
+    The input is then scanned for the literals with a substring search, and
+    the automaton is only run over the barrier-free windows around the hits,
+    rather than over every byte of the input """
+
+from weightedRegex import *
+from startSet import acceptedByTree
+
+MAX_LITERALS = 16  # Larger literal sets aren't worth searching for
+MAX_COUNT = 64  # Counted repetitions repeated more often give no exact literals
+NO_WINDOW = (-1, -1)
+
+
+class LiteralInfo(object):
+    """ What is known of the strings matched by a node:
+            exact: every string the node matches, or None if there are
+                   too many
+            required: literals one of which every match contains, or None
+                      if nothing is known
+    """
+    _imutable_fields_ = ["exact[*]", "required[*]"]
+
+    def __init__(self, exact, required):
+        self.exact = exact
+        self.required = required
+
+
+def shortest(literals):
+    m = -1
+    for l in literals:
+        if m == -1 or len(l) < m:
+            m = len(l)
+    return m
+
+
+def better(a, b):
+    """ Returns the more selective of two literal sets: the one whose
+        shortest literal is longer, then the smaller one """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if shortest(b) > shortest(a) or shortest(b) == shortest(a) and len(b) < len(a):
+        return b
+    return a
+
+
+def addLiteral(literals, l):
+    if l not in literals:
+        literals.append(l)
+
+
+def concatLiterals(left, right):
+    """ The cross product of two literal sets, or None if it's too large """
+    if left is None or right is None or len(left) * len(right) > MAX_LITERALS:
+        return None
+    literals = []
+    for l in left:
+        for r in right:
+            addLiteral(literals, l + r)
+    return literals
+
+
+def unionLiterals(left, right):
+    if left is None or right is None or len(left) + len(right) > MAX_LITERALS:
+        return None
+    literals = []
+    for l in left:
+        addLiteral(literals, l)
+    for r in right:
+        addLiteral(literals, r)
+    return literals
+
+
+def requiredOf(info):
+    return better(info.required, info.exact)
+
+
+def analyseLiterals(node):
+    """ Works out the LiteralInfo of node """
+    if isinstance(node, Sym):
+        c = node.weightFunction.literal()
+        if c == -1:
+            return LiteralInfo(None, None)
+        return LiteralInfo([chr(c)], None)
+
+    elif isinstance(node, Eps):
+        return LiteralInfo([""], None)
+
+    elif isinstance(node, Seq):
+        left = analyseLiterals(node.left)
+        right = analyseLiterals(node.right)
+        exact = concatLiterals(left.exact, right.exact)
+        return LiteralInfo(exact, better(requiredOf(left), requiredOf(right)))
+
+    elif isinstance(node, Alt):
+        left = analyseLiterals(node.left)
+        right = analyseLiterals(node.right)
+        exact = unionLiterals(left.exact, right.exact)
+        return LiteralInfo(exact, unionLiterals(requiredOf(left), requiredOf(right)))
+
+    elif isinstance(node, SeqN):
+        # Runs of children with exact sets are joined into longer literals,
+        # until their cross product gets too large
+        required = None
+        run = [""]
+        exact = True
+        for child in node.children:
+            info = analyseLiterals(child)
+            required = better(required, info.required)
+            joined = concatLiterals(run, info.exact)
+            if joined is None:
+                exact = False
+                required = better(required, run)
+                run = [""]
+                if info.exact is not None:
+                    run = info.exact
+            else:
+                run = joined
+        required = better(required, run)
+        if exact:
+            return LiteralInfo(run, required)
+        return LiteralInfo(None, required)
+
+    elif isinstance(node, AltN):
+        exact = []
+        required = []
+        for child in node.children:
+            info = analyseLiterals(child)
+            exact = unionLiterals(exact, info.exact)
+            required = unionLiterals(required, requiredOf(info))
+        return LiteralInfo(exact, required)
+
+    elif isinstance(node, Plus):
+        return LiteralInfo(None, requiredOf(analyseLiterals(node.exp)))
+
+    elif isinstance(node, Rep):
+        return LiteralInfo(None, None)
+
+    elif isinstance(node, Count):
+        exp = analyseLiterals(node.exp)
+        required = None
+        if node.low > 0:
+            required = requiredOf(exp)
+        if node.high > MAX_COUNT:
+            return LiteralInfo(None, required)  # Not unrolled
+        exact = [""]
+        for k in range(node.high):
+            if k < node.low:
+                exact = concatLiterals(exact, exp.exact)
+            else:
+                exact = concatLiterals(exact, unionLiterals(exp.exact, [""]))
+            if exact is None:
+                break
+        return LiteralInfo(exact, required)
+
+    else:
+        assert isinstance(node, Question)
+        exp = analyseLiterals(node.exp)
+        return LiteralInfo(unionLiterals(exp.exact, [""]), None)
+
+
+class Prefilter(object):
+    """ Finds the windows of a string which may hold a match """
+    _imutable_fields_ = ["literals[*]", "barrier[*]"]
+
+    def __init__(self, literals, barrier):
+        self.literals = literals
+        self.barrier = barrier
+        self.nextHit = [-1] * len(literals)
+        self.windows = 0
+        self.scanned = 0
+
+    def copy(self):
+        """ Returns a Prefilter for the same literals, with nothing found """
+        return Prefilter(self.literals, self.barrier)
+
+    def reset(self):
+        """ Forgets the hits found, before searching another string """
+        for i in range(len(self.nextHit)):
+            self.nextHit[i] = -1
+
+    def findHit(self, s, pos):
+        """ Returns the index of the first literal hit at or after pos,
+            or -1. Hits are remembered, so each literal is searched for
+            at most once per hit """
+        assert pos >= 0
+        hit = -1
+        for i in range(len(self.literals)):
+            if self.nextHit[i] != len(s) and self.nextHit[i] < pos:
+                h = s.find(self.literals[i], pos)
+                if h == -1:
+                    h = len(s)
+                self.nextHit[i] = h
+            if self.nextHit[i] < len(s) and (hit == -1 or self.nextHit[i] < hit):
+                hit = self.nextHit[i]
+        return hit
+
+    def nextWindow(self, s, pos):
+        """ Returns the (start, end) of the first window at or after pos
+            which may hold a match, or NO_WINDOW. A window is the run of
+            non-barrier bytes around a literal hit """
+        hit = self.findHit(s, pos)
+        if hit == -1:
+            return NO_WINDOW
+
+        start = hit
+        while start > pos and not self.barrier[ord(s[start - 1])]:
+            start -= 1
+        end = hit
+        while end < len(s) and not self.barrier[ord(s[end])]:
+            end += 1
+        return (start, end)
+
+    def nextRun(self, s, pos, tail):
+        """ Returns the (start, end) of the next stretch of s from pos on
+            to run a matcher over, or NO_WINDOW. This is a window extended
+            by tail bytes, for a matcher that needs to see a few bytes past
+            the end of a match; windows closer together than that are
+            merged """
+        window = self.nextWindow(s, pos)
+        if window == NO_WINDOW:
+            return NO_WINDOW
+
+        start, end = window
+        window = self.nextWindow(s, end + 1)
+        while window != NO_WINDOW and window[0] < end + tail:
+            end = window[1]
+            window = self.nextWindow(s, end + 1)
+        end = min(end + tail, len(s))
+
+        self.windows += 1
+        self.scanned += end - start
+        return (start, end)
+
+    def stats(self):
+        return "prefilter: literals=%d windows=%d scanned=%d\n" % (
+            len(self.literals), self.windows, self.scanned)
+
+
+def buildPrefilter(ast, rig):
+    """ Creates a Prefilter for the tree ast, before it is wrapped for
+        partial matching. Returns None if no literal is required of every
+        match """
+    literals = requiredOf(analyseLiterals(ast))
+    if literals is None or shortest(literals) < 1:
+        return None
+
+    accepted = acceptedByTree(ast, rig)
+    return Prefilter(literals, [not a for a in accepted])
@@ -0,0 +1,182 @@
+""" Finds the leftmost longest match using only the boolean rig. Carrying
+    positions through the position rigs costs a tuple comparison on every
+    mult and plus; instead, three boolean passes are made. The pattern is
+    first run forwards, starting a match at every position up to the first
+    at which one ends and then only carrying on those already started until
+    none are left, so the last position at which it accepted bounds the end
+    of every match the leftmost can be. A window without a match costs this
+    pass alone. The reversed pattern is then run backwards from that bound,
+    which gives every position at which a match starts, so the leftmost
+    start is the last one seen. Finally the pattern is run forwards again,
+    anchored at that start, and the last position at which it accepted is
+    the end of the longest match. A pattern whose automata would be too
+    large to build gets no RangeFinder, and is searched with the position
+    rigs instead """
+
+from weightedRegex import *
+from glushkov import boundedAutomaton, Glushkov
+from startSet import buildStartSet
+from rpython.rlib.jit import JitDriver
+
+endDriver = JitDriver(reds=["i", "end", "last", "s"], greens=["self", "rig", "f"])
+startDriver = JitDriver(reds=["i", "start", "found", "s"], greens=["self", "rig", "b"])
+longestDriver = JitDriver(reds=["i", "end", "last", "s"], greens=["self", "rig", "f"])
+
+NO_MATCH = (-1, -1)
+
+
+def reverseTree(node, rig):
+    """ Returns a tree matching the reverse of each string node matches """
+    if isinstance(node, Sym):
+        return node.copy()
+
+    elif isinstance(node, Eps):
+        return Eps(rig)
+
+    elif isinstance(node, Seq):
+        return Seq(reverseTree(node.right, rig), reverseTree(node.left, rig), rig)
+
+    elif isinstance(node, Alt):
+        return Alt(reverseTree(node.left, rig), reverseTree(node.right, rig), rig)
+
+    elif isinstance(node, SeqN):
+        children = [reverseTree(child, rig) for child in node.children]
+        children.reverse()
+        return SeqN(children, rig)
+
+    elif isinstance(node, AltN):
+        return AltN([reverseTree(child, rig) for child in node.children], rig)
+
+    elif isinstance(node, Rep):
+        return Rep(reverseTree(node.exp, rig), rig)
+
+    elif isinstance(node, Count):
+        return createCount(reverseTree(node.exp, rig), node.low, node.high, rig)
+
+    elif isinstance(node, Plus):
+        return Plus(reverseTree(node.exp, rig), rig)
+
+    else:
+        assert isinstance(node, Question)
+        return Question(reverseTree(node.exp, rig), rig)
+
+
+class RangeFinder(object):
+    """ Runs the forward and backward passes over the BitRig. The pattern
+        mustn't match the empty string """
+    _imutable_fields_ = ["forward", "backward", "canStart", "canEnd"]
+
+    def __init__(self, forward, backward, canStart, canEnd, rig):
+        self.rig = rig
+        self.forward = Glushkov(forward, rig)
+        self.canStart = canStart
+        self.backward = Glushkov(backward, rig)
+        self.canEnd = canEnd
+
+    def copy(self):
+        """ Returns a RangeFinder running the same automata, with its own
+            state """
+        return RangeFinder(self.forward.automaton, self.backward.automaton,
+                           self.canStart, self.canEnd, self.rig)
+
+    def lastEnd(self, s, start, end):
+        """ Returns the index into s of the last byte of any match between
+            start and end starting no later than the first byte at which a
+            match ends, or -1 if there is no match """
+        rig = self.rig
+        f = self.forward
+        f.reset()
+        last = -1
+        i = start
+        while i < end:
+
+            endDriver.can_enter_jit(self=self, rig=rig, f=f, i=i, end=end, last=last, s=s)
+            endDriver.jit_merge_point(self=self, rig=rig, f=f, i=i, end=end, last=last, s=s)
+
+            c = ord(s[i])
+            if last != -1:
+                f.shift(rig.zero, c, i)
+            elif f.nActive == 0 and not self.canStart[c]:
+                i += 1  # Nothing to do until a match could start here
+                continue
+            else:
+                f.shift(rig.one, c, i)
+            if f.updateFinal() != rig.zero:
+                last = i
+            if last != -1 and f.nActive == 0:
+                break
+            i += 1
+        return last
+
+    def leftmostStart(self, s, start, end):
+        """ Returns the index into s of the leftmost byte between start and
+            end at which a match starts, or -1 """
+        rig = self.rig
+        b = self.backward
+        b.reset()
+        found = -1
+        i = end - 1
+        while i >= start:
+
+            startDriver.can_enter_jit(self=self, rig=rig, b=b, i=i, start=start, found=found, s=s)
+            startDriver.jit_merge_point(self=self, rig=rig, b=b, i=i, start=start, found=found, s=s)
+
+            c = ord(s[i])
+            if b.nActive == 0 and not self.canEnd[c]:
+                i -= 1  # Nothing to do until a match could end here
+                continue
+            b.shift(rig.one, c, i)
+            if b.updateFinal() != rig.zero:
+                found = i
+            i -= 1
+        return found
+
+    def longestEnd(self, s, start, end):
+        """ Returns the index into s of the last byte of the longest match
+            starting at index start, looking no further than end """
+        rig = self.rig
+        f = self.forward
+        f.reset()
+        f.shift(rig.one, ord(s[start]), start)
+        last = -1
+        i = start
+        while True:
+
+            longestDriver.can_enter_jit(self=self, rig=rig, f=f, i=i, end=end, last=last, s=s)
+            longestDriver.jit_merge_point(self=self, rig=rig, f=f, i=i, end=end, last=last, s=s)
+
+            if f.updateFinal() != rig.zero:
+                last = i
+            if f.nActive == 0 or i == end - 1:
+                break
+            i += 1
+            f.shift(rig.zero, ord(s[i]), i)
+        return last
+
+    def find(self, s, start, end, wantEnd):
+        """ Returns the (start, end) positions of the leftmost longest match
+            in s between start and end, or NO_MATCH. The end is only looked
+            for if wantEnd is set, and is -1 otherwise """
+        last = self.lastEnd(s, start, end)
+        if last == -1:
+            return NO_MATCH
+        first = self.leftmostStart(s, start, last + 1)
+        if not wantEnd:
+            return (first, -1)
+        return (first, self.longestEnd(s, first, last + 1))
+
+
+def buildRangeFinder(ast, rig):
+    """ Returns a RangeFinder for the tree ast, or None if either of its
+        automata would be larger than MAX_SIZE """
+    forward = boundedAutomaton(ast, rig)
+    if forward is None:
+        return None
+    reversed = reverseTree(ast, rig)
+    backward = boundedAutomaton(reversed, rig)
+    if backward is None:
+        return None
+    # The bytes the reversed pattern can start with are those a match can
+    # end with
+    return RangeFinder(forward, backward, buildStartSet(ast, rig).canStart,
+                       buildStartSet(reversed, rig).canStart, rig)
@@ -10,8 +10,10 @@ def toInt(f):
     return wrapper
 
 class Rig(object):
+    name = "rig"  # Identifies the rig a pattern was compiled for
     one = (0, 0)
     zero = (0, 0)
+    idempotent = False  # Whether plus(x, x) == x
 
     def mult(self, x, y):
         return self.one
@@ -19,13 +21,14 @@ class Rig(object):
     def plus(self, x, y):
         return self.one
 
-    def autoMatch(self, sym):
+    def autoMatch(self, pos):
         # Shouldn't really be part of the rigs, but necessary
         return self.one
 
 class IntRig(Rig):
     """ Simple Z+ semiring """
 
+    name = "int"
     one = (1, 0)
     zero = (0, 0)
 
@@ -43,8 +46,10 @@ class BitRig(Rig):
         instead
     """
 
+    name = "bit"
     one = (1, 0)
     zero = (0, 0)
+    idempotent = True
 
     @toInt
     def mult(self, x, y):
@@ -62,8 +67,10 @@ class StartPositionRig(Rig):
         index of the character matched.
     """
 
+    name = "start position"
     one = (-1, 0)
     zero = (-2, 0)
+    idempotent = True
 
     def mult(self, x, y):  # Reperesenting a concatanation
         if x == self.zero or y == self.zero:
@@ -85,8 +92,8 @@ class StartPositionRig(Rig):
         else:
             return (0, min(x[1], y[1]))
 
-    def autoMatch(self, sym):
-        return (0, sym[0])
+    def autoMatch(self, pos):
+        return (0, pos)
 
 class StartEndPositionRig(Rig):
     """ A rig that finds the start of the end of the leftmost
@@ -95,8 +102,10 @@ class StartEndPositionRig(Rig):
             Plus: pick the longest leftmost match
     """
 
+    name = "start end position"
     one = (-1, -1)
     zero = (-2, -2)
+    idempotent = True
 
     def mult(self, x, y):  # Reperesenting a concatanation
         if x == self.zero or y == self.zero:
@@ -114,5 +123,12 @@ class StartEndPositionRig(Rig):
         else:  # Fewer branches => faster JIT
             return x
 
-    def autoMatch(self, sym):
-        return (sym[0], sym[0])
+    def autoMatch(self, pos):
+        return (pos, pos)
+
+def createRig(name):
+    """ Returns a new rig of the class whose name is name, or None """
+    for rig in [IntRig(), BitRig(), StartPositionRig(), StartEndPositionRig()]:
+        if rig.name == name:
+            return rig
+    return None
@@ -0,0 +1,232 @@
+""" The loops which run a compiled tree over an input in each mode, and
+    the searches built on them, which skip the parts of the input a
+    prefilter or start set rules out """
+
+import os
+from prefilter import NO_WINDOW
+from reverse import NO_MATCH
+from rpython.rlib.jit import JitDriver
+
+jitdriver = JitDriver(reds=["i", "end", "base", "s", "ans", "prevAns"], greens=["mode", "r", "rig", "startSet"])
+lineDriver = JitDriver(reds=["i", "end", "s"], greens=["r", "rig", "startSet"])
+nModes = 5
+PARTIAL_MATCH, COMPLETE_MATCH, FIND_LEFTMOST_START,\
+    FIND_LEFTMOST_RANGE, FIND_ALL = range(0, nModes)
+
+# FIND_ALL reports a match up to two symbols after its end, so a window is
+# run this far past its last byte
+MATCH_TAIL = 2
+
+
+def search(r, s, start, end, rig, mode, prefilter, startSet):
+    """ Runs mainloop over the windows of s[start:end] picked out by the
+        prefilter. Only FIND_ALL needs to look past the first window with
+        a match """
+    if prefilter is None or start == end:
+        return mainloop(r, s, start, end, rig, mode, startSet)
+
+    ans = []
+    pos = start
+    while True:
+        window = prefilter.nextRun(s, pos, MATCH_TAIL)
+        if window == NO_WINDOW or window[0] >= end:
+            break
+        wStart, wEnd = window
+        r.reset()
+        for a in mainloop(r, s, wStart, min(wEnd, end), rig, mode, startSet):
+            if a != rig.zero:
+                ans.append(a)
+        if ans and mode != FIND_ALL:
+            break
+        pos = wEnd
+
+    return ans
+
+
+def searchInput(r, s, fd, rig, mode, prefilter, startSet, options, out):
+    """ Runs search over s, or if fd isn't -1, streams the input from fd
+        through streamloop, which hands the matches to the MatchWriter out
+        as it finds them if out isn't None """
+    if fd != -1:
+        return streamloop(r, fd, rig, mode, startSet, options.chunkSize, out)
+    return search(r, s, 0, len(s), rig, mode, prefilter, startSet)
+
+
+def searchRange(finder, s, prefilter, wantEnd):
+    """ Runs the finder over the windows of s picked out by the prefilter,
+        returning the first match found """
+    if prefilter is None:
+        return finder.find(s, 0, len(s), wantEnd)
+
+    pos = 0
+    while True:
+        window = prefilter.nextRun(s, pos, 0)
+        if window == NO_WINDOW:
+            return NO_MATCH
+        start, end = window
+        match = finder.find(s, start, end, wantEnd)
+        if match != NO_MATCH:
+            return match
+        pos = end
+
+
+def mainloop(r, s, start, end, rig, mode, startSet):
+    """ Returns if s[start:end] matches the regex r. If startSet isn't None,
+        r must be wrapped for partial matching, and runs of bytes which
+        can't start a match are skipped while the pattern has no marks.
+        The position of each byte is its index in s """
+
+    if start == end:
+        return [r.empty()]
+
+    r.shift(rig.one, ord(s[start]), start)  # Want to shift in an initial mark to start the
+    # NFA
+
+    ans = []
+    runLoop(r, s, start, end, 0, rig, mode, startSet, ans, rig.zero)
+    finishLoop(r, s, end, 0, rig, mode, startSet, ans)
+    return ans
+
+
+def streamloop(r, fd, rig, mode, startSet, chunkSize, out):
+    """ mainloop over the input read from the file descriptor fd, chunkSize
+        bytes at a time. The last byte of each chunk is carried over to
+        the front of the next, as it may be shifted again after a match,
+        so only one chunk is held at once. If out isn't None, the matches
+        found in each chunk are written to it before the next is read,
+        and none are returned """
+
+    s = os.read(fd, chunkSize)
+    if len(s) == 0:
+        ans = [r.empty()]
+        if out is not None:
+            out.write(ans)
+            return []
+        return ans
+    base = 0  # The position of s[0] in the input
+
+    r.shift(rig.one, ord(s[0]), 0)
+
+    ans = []
+    prevAns = rig.zero
+    while True:
+        prevAns = runLoop(r, s, 0, len(s), base, rig, mode, startSet, ans, prevAns)
+        if out is not None and ans:
+            out.write(ans)
+            ans = []
+        chunk = os.read(fd, chunkSize)
+        if len(chunk) == 0:
+            break
+        base += len(s) - 1
+        s = s[len(s) - 1] + chunk
+
+    finishLoop(r, s, len(s), base, rig, mode, startSet, ans)
+    if out is not None:
+        out.write(ans)
+        return []
+    return ans
+
+
+def lineMatches(r, s, start, end, rig, startSet):
+    """ Returns whether the line s[start:end] holds a match of r, which must
+        be wrapped for partial matching, so that its final weight stays
+        non-zero once a match has ended. The line is only read up to the
+        first byte a match ends at, and as in runLoop, runs of bytes which
+        can't start a match are skipped while the pattern has no marks """
+    r.reset()
+    if start == end:
+        return r.empty() != rig.zero
+
+    r.shift(rig.one, ord(s[start]), start)
+    i = start
+    while True:
+
+        lineDriver.can_enter_jit(r=r, rig=rig, startSet=startSet, i=i, end=end, s=s)
+        lineDriver.jit_merge_point(r=r, rig=rig, startSet=startSet, i=i, end=end, s=s)
+
+        if r.updateFinal() != rig.zero:
+            return True
+        if i == end - 1:
+            return False
+
+        if startSet is not None and startSet.idle(ord(s[i])):
+            j = startSet.nextStart(s, i + 1, end)
+            if j == end:
+                return False  # Nothing left in the line can start a match
+            i = j - 1
+
+        r.shift(rig.zero, ord(s[i+1]), i + 1)
+        i += 1
+
+
+def runLoop(r, s, i, end, base, rig, mode, startSet, ans, prevAns):
+    """ Shifts the bytes of s after the one at i, which r has already
+        consumed, up to end into r, adding the matches found to ans. The
+        position of s[i] in the input is base + i. prevAns is the final
+        weight before the first byte's, and the final weight before the
+        last byte's is returned, so that the loop can carry on over the
+        next chunk of a stream """
+
+    while i < end - 1:  # Main program loop
+
+        jitdriver.can_enter_jit(mode=mode, r=r, rig=rig, startSet=startSet, i=i, end=end, base=base, prevAns=prevAns, s=s, ans=ans)
+        jitdriver.jit_merge_point(mode=mode, r=r, rig=rig, startSet=startSet, i=i, end=end, base=base, prevAns=prevAns, s=s, ans=ans)
+
+        r.updateFinal()  # Explicitly call update here, cache the values
+    #    print((i+1, "%s" % s[i+1], r.final()))
+
+        if startSet is not None and r.final() == rig.zero and startSet.idle(ord(s[i])):
+            # Every mark in the pattern has been cleared and no match is
+            # pending, so the state won't change until a byte which can
+            # start a match is shifted in
+            j = startSet.nextStart(s, i + 1, end)
+            if j > i + 1:
+                i = j - 1
+                prevAns = rig.zero
+                continue
+
+        if mode == FIND_ALL:
+            r.updateFinal()
+            # Maybe be faster to use all?
+            if r.final() == prevAns and prevAns[0] >= 0: # I.e. prevAns != zero or one
+                # The longest leftmost match has been found. Reset FSM and start
+                # from the character at the end of the match
+
+                ans.append(r.final())
+                r.reset()
+                r.shift(rig.one, ord(s[i]), base + i)
+                prevAns = rig.zero
+            else:
+                prevAns = r.final()
+                r.shift(rig.zero, ord(s[i+1]), base + i + 1)
+                i += 1
+
+        else:
+            r.updateFinal()
+            r.shift(rig.zero, ord(s[i+1]), base + i + 1)
+            i += 1
+
+    return prevAns
+
+
+def finishLoop(r, s, end, base, rig, mode, startSet, ans):
+    """ Adds the final weight after the last byte of s before end to ans.
+        In FIND_ALL mode that match may end before the last byte, so the
+        bytes after it are run again for the matches runLoop didn't get
+        to. The position of s[0] in the input is base """
+    # TODO:  Find a way to use fewer conditions
+    while True:
+        r.updateFinal()
+        final = r.final()
+        if final[0] < 0:
+            return
+        ans.append(final)
+        if mode != FIND_ALL:
+            return
+        i = final[1] + 1 - base
+        if i >= end:
+            return
+        assert i >= 0
+        r.reset()
+        r.shift(rig.one, ord(s[i]), base + i)
+        runLoop(r, s, i, end, base, rig, mode, startSet, ans, rig.zero)
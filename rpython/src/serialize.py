@@ -0,0 +1,365 @@
+""" Writes compiled trees to a compact binary image, and reads them back
+    without parsing the patterns again. An image holds any number of trees,
+    each stored under its pattern, the name of its rig, the name of the
+    matcher its Syms were made with and the settings it was compiled with. Opening an image only reads its index;
+    a tree is rebuilt when it is first loaded, so opening a large catalogue
+    costs little more than reading the file.
+
+    Integers are written as unsigned varints, seven bits to a byte, and
+    strings as their length followed by their bytes. After MAGIC comes the
+    number of trees, then for each its key and the length of its bytes,
+    then the trees themselves. A tree is its table of weight functions,
+    written once each so that Syms which share a function still do once
+    loaded, followed by its nodes in prefix order """
+
+from weightedRegex import *
+from weightFunctions import *
+from rigs import createRig
+from rpython.rlib.rstring import StringBuilder
+
+MAGIC = "WRXIMG2\n"
+
+nNodeTags = 11
+SYM, EPS, SEQ, ALT, SEQN, ALTN, REP, PLUS, QUESTION, COUNT,\
+    SYMCOUNT = range(0, nNodeTags)
+
+nFunctionTags = 8
+SINGLE_SYMBOL, CLASS_TABLE, START_POSITION, START_END_POSITION,\
+    CASE_INSENSITIVE, ALL_BUT_NEWLINE, ONE, ZERO = range(0, nFunctionTags)
+
+
+class ImageError(Exception):
+    """ Raised for an image which can't be written or read """
+    def __init__(self, msg):
+        self.msg = msg
+
+
+def writeInt(out, n):
+    assert n >= 0
+    while n >= 0x80:
+        out.append(chr(n & 0x7f | 0x80))
+        n >>= 7
+    out.append(chr(n))
+
+
+def writeString(out, s):
+    writeInt(out, len(s))
+    out.append(s)
+
+
+class Reader(object):
+    """ Reads the values written by writeInt and writeString from
+        data[pos:end] """
+
+    def __init__(self, data, pos, end):
+        self.data = data
+        self.pos = pos
+        self.end = end
+
+    def byte(self):
+        if self.pos >= self.end:
+            raise ImageError("Truncated image")
+        b = ord(self.data[self.pos])
+        self.pos += 1
+        return b
+
+    def int(self):
+        n = 0
+        shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+            if shift > 56:
+                raise ImageError("Invalid integer in image")
+
+    def string(self):
+        length = self.int()
+        start = self.pos
+        end = start + length
+        if end > self.end:
+            raise ImageError("Truncated image")
+        assert start >= 0 and end >= 0
+        self.pos = end
+        return self.data[start:end]
+
+
+class TreeWriter(object):
+    """ Writes one tree """
+
+    def __init__(self):
+        self.functions = StringBuilder()
+        self.nFunctions = 0
+        self.indices = {}  # The index of each function in the table, by key
+        self.nodes = StringBuilder()
+
+    def functionIndex(self, f):
+        """ Returns the index of f in the table, adding it if it isn't
+            there yet """
+        key = f.key()
+        if key != "" and key in self.indices:
+            return self.indices[key]
+        self.writeFunction(f)
+        index = self.nFunctions
+        self.nFunctions += 1
+        if key != "":
+            self.indices[key] = index
+        return index
+
+    def writeFunction(self, f):
+        out = self.functions
+        if isinstance(f, SingleSymbolMatch):
+            writeInt(out, SINGLE_SYMBOL)
+            writeInt(out, f.sym)
+        elif isinstance(f, ClassTableMatch):
+            writeInt(out, CLASS_TABLE)
+            for i in range(0, 256, 8):
+                b = 0
+                for j in range(8):
+                    if f.table[i + j]:
+                        b |= 1 << j
+                out.append(chr(b))
+        elif isinstance(f, StartPositionMatcher):
+            writeInt(out, START_POSITION)
+            writeInt(out, f.sym)
+        elif isinstance(f, StartEndPositionMatcher):
+            writeInt(out, START_END_POSITION)
+            writeInt(out, f.sym)
+        elif isinstance(f, CaseInsensitiveWrapper):
+            writeInt(out, CASE_INSENSITIVE)
+            self.writeFunction(f.base)
+        elif isinstance(f, AllButNewLineMatcher):
+            writeInt(out, ALL_BUT_NEWLINE)
+        elif isinstance(f, OneProducer):
+            writeInt(out, ONE)
+        elif isinstance(f, ZeroProducer):
+            writeInt(out, ZERO)
+        else:
+            raise ImageError("Can't write weight function")
+
+    def writeNode(self, node):
+        out = self.nodes
+        if isinstance(node, Sym):
+            writeInt(out, SYM)
+            writeInt(out, self.functionIndex(node.weightFunction))
+            writeString(out, node.tag)
+
+        elif isinstance(node, Eps):
+            writeInt(out, EPS)
+
+        elif isinstance(node, Seq) or isinstance(node, Alt):
+            if isinstance(node, Seq):
+                writeInt(out, SEQ)
+            else:
+                writeInt(out, ALT)
+            self.writeNode(node.left)
+            self.writeNode(node.right)
+
+        elif isinstance(node, SeqN) or isinstance(node, AltN):
+            if isinstance(node, SeqN):
+                writeInt(out, SEQN)
+            else:
+                writeInt(out, ALTN)
+            writeInt(out, len(node.children))
+            for child in node.children:
+                self.writeNode(child)
+
+        elif isinstance(node, Rep):
+            writeInt(out, REP)
+            self.writeNode(node.exp)
+
+        elif isinstance(node, Plus):
+            writeInt(out, PLUS)
+            self.writeNode(node.exp)
+
+        elif isinstance(node, Question):
+            writeInt(out, QUESTION)
+            self.writeNode(node.exp)
+
+        elif isinstance(node, Count):
+            if isinstance(node, SymCount):
+                writeInt(out, SYMCOUNT)
+            else:
+                writeInt(out, COUNT)
+            writeInt(out, node.low)
+            writeInt(out, node.high)
+            self.writeNode(node.exp)
+
+        else:
+            raise ImageError("Can't write node")
+
+    def build(self):
+        out = StringBuilder()
+        writeInt(out, self.nFunctions)
+        out.append(self.functions.build())
+        out.append(self.nodes.build())
+        return out.build()
+
+
+def dumpTree(ast):
+    """ Returns the bytes of the tree ast """
+    writer = TreeWriter()
+    writer.writeNode(ast)
+    return writer.build()
+
+
+class TreeReader(object):
+    """ Rebuilds a tree written by TreeWriter over rig """
+
+    def __init__(self, reader, rig):
+        self.reader = reader
+        self.rig = rig
+        self.functions = []
+        for i in range(reader.int()):
+            self.functions.append(self.readFunction())
+
+    def readSym(self):
+        sym = self.reader.int()
+        if sym > 255:
+            raise ImageError("Invalid symbol in image")
+        return sym
+
+    def readFunction(self):
+        rig = self.rig
+        tag = self.reader.int()
+        if tag == SINGLE_SYMBOL:
+            return SingleSymbolMatch(self.readSym(), rig)
+        elif tag == CLASS_TABLE:
+            table = [False] * 256
+            for i in range(0, 256, 8):
+                b = self.reader.byte()
+                for j in range(8):
+                    table[i + j] = b & (1 << j) != 0
+            return ClassTableMatch(table, rig)
+        elif tag == START_POSITION:
+            return StartPositionMatcher(self.readSym(), rig)
+        elif tag == START_END_POSITION:
+            return StartEndPositionMatcher(self.readSym(), rig)
+        elif tag == CASE_INSENSITIVE:
+            return CaseInsensitiveWrapper(self.readFunction(), rig)
+        elif tag == ALL_BUT_NEWLINE:
+            return AllButNewLineMatcher(rig)
+        elif tag == ONE:
+            return OneProducer(rig)
+        elif tag == ZERO:
+            return ZeroProducer(rig)
+        raise ImageError("Invalid weight function in image")
+
+    def readNode(self):
+        rig = self.rig
+        tag = self.reader.int()
+        if tag == SYM:
+            index = self.reader.int()
+            if index >= len(self.functions):
+                raise ImageError("Invalid weight function in image")
+            return Sym(self.functions[index], rig, self.reader.string())
+
+        elif tag == EPS:
+            return Eps(rig)
+
+        elif tag == SEQ:
+            left = self.readNode()
+            return Seq(left, self.readNode(), rig)
+
+        elif tag == ALT:
+            left = self.readNode()
+            return Alt(left, self.readNode(), rig)
+
+        elif tag == SEQN or tag == ALTN:
+            children = []
+            for i in range(self.reader.int()):
+                children.append(self.readNode())
+            if tag == SEQN:
+                return SeqN(children, rig)
+            return AltN(children, rig)
+
+        elif tag == REP:
+            return Rep(self.readNode(), rig)
+
+        elif tag == PLUS:
+            return Plus(self.readNode(), rig)
+
+        elif tag == QUESTION:
+            return Question(self.readNode(), rig)
+
+        elif tag == COUNT or tag == SYMCOUNT:
+            low = self.reader.int()
+            high = self.reader.int()
+            if low > high or high == 0:
+                raise ImageError("Invalid count in image")
+            exp = self.readNode()
+            if tag == COUNT:
+                return Count(exp, low, high, rig)
+            if not isinstance(exp, Sym):
+                raise ImageError("Invalid count in image")
+            return SymCount(exp, low, high, rig)
+
+        raise ImageError("Invalid node in image")
+
+
+def dumpImage(keys, asts):
+    """ Returns an image holding each tree in asts under the key at the
+        same index of keys. A key is a (pattern, rig name, matcher name,
+        settings) tuple """
+    trees = [dumpTree(ast) for ast in asts]
+    out = StringBuilder()
+    out.append(MAGIC)
+    writeInt(out, len(keys))
+    for i in range(len(keys)):
+        re, rigName, matcherName, settings = keys[i]
+        writeString(out, re)
+        writeString(out, rigName)
+        writeString(out, matcherName)
+        writeString(out, settings)
+        writeInt(out, len(trees[i]))
+    for tree in trees:
+        out.append(tree)
+    return out.build()
+
+
+class PatternImage(object):
+    """ An image opened for loading trees from """
+
+    def __init__(self, data):
+        if not data.startswith(MAGIC):
+            raise ImageError("Not a pattern image")
+        self.data = data
+        self.trees = {}  # The (start, end) of the bytes of each tree, by key
+        self.loaded = 0
+
+        reader = Reader(data, len(MAGIC), len(data))
+        keys = []
+        lengths = []
+        for i in range(reader.int()):
+            re = reader.string()
+            rigName = reader.string()
+            matcherName = reader.string()
+            keys.append((re, rigName, matcherName, reader.string()))
+            lengths.append(reader.int())
+        pos = reader.pos
+        for i in range(len(keys)):
+            if pos + lengths[i] > len(data):
+                raise ImageError("Truncated image")
+            self.trees[keys[i]] = (pos, pos + lengths[i])
+            pos += lengths[i]
+
+    def load(self, key):
+        """ Returns a new copy of the tree stored under key, or None if
+            there isn't one """
+        if key not in self.trees:
+            return None
+        rig = createRig(key[1])
+        if rig is None:
+            raise ImageError("Unknown rig in image: %s" % key[1])
+        start, end = self.trees[key]
+        reader = Reader(self.data, start, end)
+        ast = TreeReader(reader, rig).readNode()
+        if reader.pos != end:
+            raise ImageError("Invalid tree in image")
+        self.loaded += 1
+        return ast
+
+    def stats(self):
+        return "image: trees=%d loaded=%d\n" % (len(self.trees), self.loaded)
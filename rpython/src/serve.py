@@ -0,0 +1,116 @@
+""" Answers the requests of --serve, read from stdin or from the clients of
+    a Unix socket, each sent as frames. The server keeps its pattern cache,
+    and so the JIT's traces, between requests """
+
+import os
+import stat
+from parser import ReSyntaxError
+from serialize import ImageError
+from compiled import Compiled, UsageError, openCache, namedPattern
+from inputs import readFile
+from frames import FrameReader, FrameError, encodeFrame, writeAll
+from rpython.rlib.rstring import StringBuilder
+from rpython.rlib import rsocket, rsignal
+
+def answerRequest(cache, re, modeField, source, data, options):
+    """ Returns the answer to a --serve request to run re in the mode given
+        by modeField over data, if source is "string", or over the file
+        named by data, if it's "file" """
+    try:
+        mode = int(modeField)
+    except ValueError:
+        return "Invalid mode option"
+    try:
+        if options.named:
+            re = namedPattern(re)
+        if source == "string":
+            s = data
+        elif source == "file":
+            s = readFile(data)
+        else:
+            return "Unknown input source: %s" % source
+        return Compiled(re, mode, options, cache).answer(s, -1)
+    except ReSyntaxError:
+        return "Syntax error"
+    except UsageError as e:
+        return e.msg
+    except ImageError as e:
+        return e.msg
+    except OSError:
+        return "cannot read"
+
+
+def serveRequest(reader, outFd, cache, options):
+    """ Answers the next request read by the FrameReader reader, writing the
+        answer to outFd as a frame. A request is four frames: the pattern,
+        the mode, the source of the input, "string" or "file", and the
+        input itself or the name of the file to read it from. Returns False
+        if the input ended before the request """
+    re = reader.readFrame()
+    if re is None:
+        return False
+    modeField = reader.readFrame()
+    source = reader.readFrame()
+    data = reader.readFrame()
+    if modeField is None or source is None or data is None:
+        raise FrameError("Truncated request")
+    out = StringBuilder()
+    encodeFrame(out, answerRequest(cache, re, modeField, source, data, options))
+    writeAll(outFd, out.build())
+    return True
+
+
+def serveRequests(inFd, outFd, cache, options):
+    """ Answers the requests read from inFd until it's closed """
+    reader = FrameReader(inFd)
+    while serveRequest(reader, outFd, cache, options):
+        pass
+
+
+def removeStaleSocket(path):
+    """ Removes the socket at path if no server is listening on it, as one
+        left behind by a server which was killed would make bind fail """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    if not stat.S_ISSOCK(st[stat.ST_MODE]):
+        raise UsageError("%s exists and isn't a socket" % path)
+    probe = rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM)
+    try:
+        probe.connect(rsocket.UNIXAddress(path))
+    except rsocket.SocketError:
+        probe.close()
+        os.unlink(path)
+        return
+    probe.close()
+    raise UsageError("A server is already listening on %s" % path)
+
+
+def serve(options):
+    """ Answers requests from stdin, or from clients of the Unix socket
+        named in options. The pattern cache, and so the trees the JIT has
+        traced, are kept for as long as the server runs. Connections are
+        taken one at a time and each is closed once its request has been
+        answered, so that a client can't keep the others waiting between
+        its requests; a client with several requests connects for each """
+    cache = openCache(options)
+    if options.socket == "":
+        serveRequests(0, 1, cache, options)
+        return
+
+    # A client closing its connection early mustn't stop the server
+    rsignal.pypysig_ignore(rsignal.SIGPIPE)
+    removeStaleSocket(options.socket)
+    listener = rsocket.RSocket(rsocket.AF_UNIX, rsocket.SOCK_STREAM)
+    listener.bind(rsocket.UNIXAddress(options.socket))
+    listener.listen(16)
+    while True:
+        fd, _ = listener.accept()
+        try:
+            serveRequest(FrameReader(fd), fd, cache, options)
+        except FrameError as e:
+            os.write(2, "%s\n" % e.msg)  # Only this connection is dropped
+        except OSError:
+            pass  # The client went away
+        os.close(fd)
@@ -0,0 +1,130 @@
+""" A bit-parallel engine for boolean matching. The positions of the Glushkov
+    automaton are packed into machine words, one bit per Sym, so a shift
+    moves every mark at once using a mask table indexed by byte class:
+        state' = (follow(state) | first) & masks[class(byte)]
+    Follow edges between consecutive positions, which concatenation produces,
+    are taken by a single shift of the words; the remaining edges are looked
+    up a byte of positions at a time """
+
+from rpython.rlib.rarithmetic import r_uint, intmask, LONG_BIT
+from weightedRegex import Expr
+from glushkov import buildAutomaton, countPositions
+from byteClasses import computeByteClasses
+
+MAX_WORDS = 4  # Patterns needing more words than this use the tree
+CHUNK_BITS = 8
+CHUNKS_PER_WORD = LONG_BIT // CHUNK_BITS
+
+
+def setBit(words, offset, p):
+    """ Sets bit p of the bitset stored from words[offset] """
+    words[offset + p // LONG_BIT] |= r_uint(1) << (p % LONG_BIT)
+
+
+class ShiftAnd(Expr):
+    """ Runs a position automaton over the BitRig with bit-parallel
+        operations, with the same interface as the tree """
+
+    _imutable_fields_ = ["nWords", "classOf[*]", "masks[*]", "firstMask[*]", "lastMask[*]",
+                         "shiftMask[*]", "jumpMask[*]", "jumpTable[*]"]
+
+    def __init__(self, automaton, rig):
+        Expr.__init__(self, rig)
+        self._empty = automaton.emptyWeight
+        n = automaton.size()
+        nWords = (n + LONG_BIT - 1) // LONG_BIT
+        if nWords == 0:
+            nWords = 1
+        self.nWords = nWords
+
+        # masks[k * nWords + w] holds word w of the positions accepting the
+        # bytes of class k
+        classes = computeByteClasses(automaton.weightFunctions, rig)
+        self.classOf = classes.classOf
+        self.masks = [r_uint(0)] * (classes.nClasses * nWords)
+        for p in range(n):
+            f = automaton.weightFunctions[p]
+            for k in range(classes.nClasses):
+                if f.call(classes.representative[k], 0) != rig.zero:
+                    setBit(self.masks, k * nWords, p)
+
+        self.firstMask = [r_uint(0)] * nWords
+        for e in automaton.first:
+            setBit(self.firstMask, 0, e.target)
+
+        self.lastMask = [r_uint(0)] * nWords
+        for p in range(n):
+            if automaton.lastWeight[p] != rig.zero:
+                setBit(self.lastMask, 0, p)
+
+        # Edges p -> p + 1 are followed by shifting, the others by table
+        # lookups on the chunk of positions holding their source
+        self.shiftMask = [r_uint(0)] * nWords
+        self.jumpMask = [r_uint(0)] * nWords
+        self.jumpTable = [r_uint(0)] * (nWords * CHUNKS_PER_WORD * 256 * nWords)
+        for q in range(n):
+            for e in automaton.follow[q]:
+                if e.target == q + 1:
+                    setBit(self.shiftMask, 0, e.target)
+                else:
+                    setBit(self.jumpMask, 0, q)
+                    chunk = q // CHUNK_BITS
+                    bit = q % CHUNK_BITS
+                    for v in range(256):
+                        if v & (1 << bit):
+                            setBit(self.jumpTable, (chunk * 256 + v) * nWords, e.target)
+
+        self.state = [r_uint(0)] * nWords
+        self.next = [r_uint(0)] * nWords
+
+    def shift(self, mark, c, pos):
+        nWords = self.nWords
+        state = self.state
+        next = self.next
+
+        carry = r_uint(0)
+        for w in range(nWords):
+            d = state[w]
+            next[w] = ((d << 1) | carry) & self.shiftMask[w]
+            carry = d >> (LONG_BIT - 1)
+
+        for w in range(nWords):
+            d = state[w] & self.jumpMask[w]
+            chunk = w * CHUNKS_PER_WORD
+            while d:
+                v = intmask(d & r_uint(0xff))
+                if v:
+                    row = (chunk * 256 + v) * nWords
+                    for x in range(nWords):
+                        next[x] |= self.jumpTable[row + x]
+                d >>= CHUNK_BITS
+                chunk += 1
+
+        if mark != self._rig.zero:
+            for w in range(nWords):
+                next[w] |= self.firstMask[w]
+
+        row = self.classOf[c] * nWords
+        for w in range(nWords):
+            state[w] = next[w] & self.masks[row + w]
+
+    def updateFinal(self):
+        self._final = self._rig.zero
+        for w in range(self.nWords):
+            if self.state[w] & self.lastMask[w]:
+                self._final = self._rig.one
+                break
+        return self._final
+
+    def reset(self):
+        for w in range(self.nWords):
+            self.state[w] = r_uint(0)
+        self._final = self._rig.zero
+
+
+def compileShiftAnd(ast, rig):
+    """ Compiles the tree ast, whose rig must be the BitRig, into a ShiftAnd
+        engine. Returns ast itself if it has too many positions to fit """
+    if countPositions(ast) > MAX_WORDS * LONG_BIT:
+        return ast
+    return ShiftAnd(buildAutomaton(ast, rig), rig)
@@ -0,0 +1,203 @@
+""" Simplifies a compiled tree before it is matched. Redundant nodes are
+    rewritten away, keeping the weights the tree gives every string, and
+    Syms whose weight functions give the same weights are made to share
+    one function. Rewrites which only hold when plus is idempotent, such
+    as Rep(Rep(x)) -> Rep(x), are only made for rigs where it is """
+
+from weightedRegex import *
+
+
+def countNodes(node):
+    """ Returns the number of nodes in the tree below node """
+    if isinstance(node, Seq) or isinstance(node, Alt):
+        return 1 + countNodes(node.left) + countNodes(node.right)
+    elif isinstance(node, Rep) or isinstance(node, Plus) or isinstance(node, Question):
+        return 1 + countNodes(node.exp)
+    elif isinstance(node, Count):
+        return 1 + countNodes(node.exp)
+    elif isinstance(node, SeqN) or isinstance(node, AltN):
+        n = 1
+        for child in node.children:
+            n += countNodes(child)
+        return n
+    return 1
+
+
+def collectFunctions(node, functions):
+    """ Adds the weight function of each Sym below node to the dict
+        functions """
+    if isinstance(node, Sym):
+        functions[node.weightFunction] = True
+    elif isinstance(node, Seq) or isinstance(node, Alt):
+        collectFunctions(node.left, functions)
+        collectFunctions(node.right, functions)
+    elif isinstance(node, Rep) or isinstance(node, Plus) or isinstance(node, Question):
+        collectFunctions(node.exp, functions)
+    elif isinstance(node, Count):
+        collectFunctions(node.exp, functions)
+    elif isinstance(node, SeqN) or isinstance(node, AltN):
+        for child in node.children:
+            collectFunctions(child, functions)
+
+
+def countFunctions(node):
+    """ Returns the number of distinct weight functions in the tree below
+        node """
+    functions = {}
+    collectFunctions(node, functions)
+    return len(functions)
+
+
+class Simplifier(object):
+    """ Simplifies trees, keeping the sizes of the last one for --stats """
+
+    def __init__(self):
+        self.rig = None
+        self.functions = {}
+        self.nodesBefore = 0
+        self.nodesAfter = 0
+        self.functionsBefore = 0
+        self.functionsAfter = 0
+
+    def simplify(self, ast, rig):
+        """ Returns the simplified tree ast, whose rig is rig """
+        self.rig = rig
+        self.functions = {}
+        self.nodesBefore = countNodes(ast)
+        self.functionsBefore = countFunctions(ast)
+        ast = self.rewrite(ast)
+        self.nodesAfter = countNodes(ast)
+        self.functionsAfter = countFunctions(ast)
+        return ast
+
+    def share(self, weightFunction):
+        """ Returns the function kept for weightFunction's key """
+        key = weightFunction.key()
+        if key == "":
+            return weightFunction
+        if key not in self.functions:
+            self.functions[key] = weightFunction
+        return self.functions[key]
+
+    def rewrite(self, node):
+        rig = self.rig
+
+        if isinstance(node, Sym):
+            return Sym(self.share(node.weightFunction), rig, node.tag)
+
+        elif isinstance(node, Eps):
+            return Eps(rig)
+
+        elif isinstance(node, Seq):
+            left = self.rewrite(node.left)
+            right = self.rewrite(node.right)
+            if isinstance(left, Eps):
+                return right
+            elif isinstance(right, Eps):
+                return left
+            return Seq(left, right, rig)
+
+        elif isinstance(node, Alt):
+            left = self.rewrite(node.left)
+            right = self.rewrite(node.right)
+            if isinstance(right, Eps) and left.empty() == rig.zero:
+                return self.makeQuestion(left)
+            elif isinstance(left, Eps) and right.empty() == rig.zero:
+                return self.makeQuestion(right)
+            elif isinstance(left, Eps) and isinstance(right, Eps) and rig.idempotent:
+                return left
+            return Alt(left, right, rig)
+
+        elif isinstance(node, SeqN):
+            children = []
+            for child in node.children:
+                child = self.rewrite(child)
+                if isinstance(child, Eps):
+                    continue
+                elif isinstance(child, SeqN) and not children:
+                    # Only a leading chain can be inlined with the same
+                    # bracketing
+                    children.extend(child.children)
+                else:
+                    children.append(child)
+            if not children:
+                return Eps(rig)
+            elif len(children) == 1:
+                return children[0]
+            return SeqN(children, rig)
+
+        elif isinstance(node, AltN):
+            children = []
+            nEps = 0
+            emptyRest = False
+            for child in node.children:
+                child = self.rewrite(child)
+                if isinstance(child, AltN):
+                    grandchildren = child.children
+                else:
+                    grandchildren = [child]
+                for c in grandchildren:
+                    if isinstance(c, Eps):
+                        nEps += 1
+                    else:
+                        if c.empty() != rig.zero:
+                            emptyRest = True
+                        children.append(c)
+            if nEps == 0 or emptyRest or nEps > 1 and not rig.idempotent:
+                if nEps > 1 and rig.idempotent:
+                    nEps = 1
+                for i in range(nEps):
+                    children.append(Eps(rig))
+                if len(children) == 1:
+                    return children[0]
+                return AltN(children, rig)
+            if not children:
+                return Eps(rig)
+            elif len(children) == 1:
+                return self.makeQuestion(children[0])
+            return self.makeQuestion(AltN(children, rig))
+
+        elif isinstance(node, Rep):
+            return self.makeRep(self.rewrite(node.exp))
+
+        elif isinstance(node, Plus):
+            exp = self.rewrite(node.exp)
+            if exp.empty() == rig.one:
+                # Plus only differs from Rep in its empty weight
+                return self.makeRep(exp)
+            elif isinstance(exp, Plus) and rig.idempotent:
+                return exp
+            return Plus(exp, rig)
+
+        elif isinstance(node, Count):
+            exp = self.rewrite(node.exp)
+            if isinstance(exp, Eps):
+                return exp
+            return createCount(exp, node.low, node.high, rig)
+
+        else:
+            assert isinstance(node, Question)
+            return self.makeQuestion(self.rewrite(node.exp))
+
+    def makeQuestion(self, exp):
+        if exp.empty() == self.rig.one:
+            return exp  # Question(x) only differs from x in its empty weight
+        return Question(exp, self.rig)
+
+    def makeRep(self, exp):
+        # Rep ignores the empty weight of its child, so a Question below it
+        # is redundant, and with an idempotent plus so is a nested loop
+        while True:
+            if isinstance(exp, Question):
+                exp = exp.exp
+            elif self.rig.idempotent and (isinstance(exp, Rep) or isinstance(exp, Plus)):
+                exp = exp.exp
+            else:
+                break
+        if isinstance(exp, Eps):
+            return exp
+        return Rep(exp, self.rig)
+
+    def stats(self):
+        return "simplify: nodes=%d->%d functions=%d->%d\n" % (
+            self.nodesBefore, self.nodesAfter, self.functionsBefore, self.functionsAfter)
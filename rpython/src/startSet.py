@@ -0,0 +1,103 @@
+""" The bytes that can start a match of a pattern. Once the pattern has no
+    marks left, which is most of the time in a sparse search, only a byte
+    that can start a match will change the state of the wrapped tree, so
+    mainloop skips straight to the next one rather than shifting every
+    byte in between. The pattern is known to have no marks after a byte no
+    position accepts, or, when the tree itself is being run, when the
+    pattern's node isn't active. Both sets are worked out from the tree
+    itself, so counted repetitions are never unrolled """
+
+from weightedRegex import *
+from simplify import collectFunctions
+
+
+def acceptedBytes(weightFunctions, rig):
+    """ Returns a table saying, for each byte, whether any of the weight
+        functions gives it a non-zero weight """
+    accepted = [False] * 256
+    for f in weightFunctions:
+        for c in range(256):
+            if not accepted[c] and f.call(c, 0) != rig.zero:
+                accepted[c] = True
+    return accepted
+
+
+class StartSet(object):
+    """ canStart[c] says whether a match can begin with byte c, and
+        consumable[c] whether any position of the pattern accepts it. A
+        byte which isn't consumable clears every mark in the pattern """
+    _imutable_fields_ = ["canStart[*]", "consumable[*]"]
+
+    def __init__(self, canStart, consumable):
+        self.canStart = canStart
+        self.consumable = consumable
+        self.pattern = None  # The pattern's node, if the tree is being run
+        self.skips = 0
+        self.skipped = 0
+
+    def copy(self):
+        return StartSet(self.canStart, self.consumable)
+
+    def idle(self, c):
+        """ Returns whether the pattern has no marks, given that byte c
+            was the last shifted in """
+        if not self.consumable[c]:
+            return True
+        return self.pattern is not None and not self.pattern.isActive()
+
+    def nextStart(self, s, i, end):
+        """ Returns the index of the first byte of s from i on, and before
+            end, which can start a match, or end if there isn't one """
+        start = i
+        while i < end and not self.canStart[ord(s[i])]:
+            i += 1
+        if i > start:
+            self.skips += 1
+            self.skipped += i - start
+        return i
+
+    def stats(self):
+        return "skip: skips=%d skipped=%d\n" % (self.skips, self.skipped)
+
+
+def collectFirst(node, rig, functions):
+    """ Adds the weight function of each Sym below node which a match of
+        node can begin with to the dict functions """
+    if isinstance(node, Sym):
+        functions[node.weightFunction] = True
+    elif isinstance(node, Seq):
+        collectFirst(node.left, rig, functions)
+        if node.left.empty() != rig.zero:
+            collectFirst(node.right, rig, functions)
+    elif isinstance(node, Alt):
+        collectFirst(node.left, rig, functions)
+        collectFirst(node.right, rig, functions)
+    elif isinstance(node, SeqN):
+        for child in node.children:
+            collectFirst(child, rig, functions)
+            if child.empty() == rig.zero:
+                break
+    elif isinstance(node, AltN):
+        for child in node.children:
+            collectFirst(child, rig, functions)
+    elif isinstance(node, Count):
+        # Every copy begins as the first does
+        if node.high > 0:
+            collectFirst(node.exp, rig, functions)
+    elif isinstance(node, Rep) or isinstance(node, Plus) or isinstance(node, Question):
+        collectFirst(node.exp, rig, functions)
+
+
+def acceptedByTree(ast, rig):
+    """ Returns the acceptedBytes of every Sym in the tree ast """
+    functions = {}
+    collectFunctions(ast, functions)
+    return acceptedBytes(functions.keys(), rig)
+
+
+def buildStartSet(ast, rig):
+    """ Creates the StartSet of the tree ast, before it is wrapped for
+        partial matching """
+    functions = {}
+    collectFirst(ast, rig, functions)
+    return StartSet(acceptedBytes(functions.keys(), rig), acceptedByTree(ast, rig))
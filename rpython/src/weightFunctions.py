@@ -1,13 +1,7 @@
 """ These are wrapper classes for weight functions: as
     RPython doesn't allow for closures, so have to use objects
-    instead """
-
-def extractSym(f):
-    # Extracts the actual character, ignoring position information
-    def wrapper(self, sym):
-        return f(self, sym[1])
-
-    return wrapper
+    instead. A symbol is passed as two ints, the byte c and its
+    position pos in the input """
 
 class WeightFunctionBase(object):
     """ Abstract base class """
@@ -17,9 +11,19 @@ class WeightFunctionBase(object):
     def __init__(self, rig):
         self.rig = rig
 
-    def call(self, sym):  # Just to allow for static typing
+    def call(self, c, pos):  # Just to allow for static typing
         return self.rig.zero
 
+    def literal(self):
+        """ The only symbol this function matches, or -1 if it isn't
+            a single literal symbol """
+        return -1
+
+    def key(self):
+        """ A string which is the same for two functions exactly when they
+            give the same weights, or "" if there isn't one """
+        return ""
+
 class SingleSymbolMatch(WeightFunctionBase):
     """ Returns a one if the symbols match, a zero otherwise """
     _imutable_fields_ = ["sym"]
@@ -28,33 +32,40 @@ class SingleSymbolMatch(WeightFunctionBase):
         WeightFunctionBase.__init__(self, rig)
         self.sym = sym
 
-    @extractSym
-    def call(self, otherSym):
-        if otherSym == self.sym:
+    def call(self, c, pos):
+        if c == self.sym:
             return self.rig.one
         else:
             return self.rig.zero
 
+    def literal(self):
+        return self.sym
+
+    def key(self):
+        return "s%d" % self.sym
+
 def createSingleSymbolMatch(sym, rig):
     return SingleSymbolMatch(sym, rig)
 
-class SymbolClassMatch(WeightFunctionBase):
-    """ Creates a matcher for a character class: takes a list of single symbol
-        matchers and adds together the call for each one"""
+class ClassTableMatch(WeightFunctionBase):
+    """ A matcher for a character class: table[c] says whether byte c is in
+        the class. A member gets the weight the rig gives any matching
+        symbol, so the same table serves every rig """
 
-    _imutable_fields_ = ["symMatchClass"]
+    _imutable_fields_ = ["table[*]"]
 
-    def __init__(self, symMatchClass, rig):
-        # symMatchClass is a list of weight function objects
+    def __init__(self, table, rig):
         WeightFunctionBase.__init__(self, rig)
-        self.symclass = symMatchClass
-        self.rig = rig
+        self.table = table
 
-    def call(self, sym):
-        s = self.rig.zero
-        for f in self.symclass:
-            s = self.rig.plus(s, f.call(sym))
-        return s
+    def call(self, c, pos):
+        if self.table[c]:
+            return self.rig.autoMatch(pos)
+        else:
+            return self.rig.zero
+
+    def key(self):
+        return "[" + "".join(["1" if member else "0" for member in self.table])
 
 class StartPositionMatcher(WeightFunctionBase):
     """ A matcher that returns the position of the char if
@@ -66,12 +77,18 @@ class StartPositionMatcher(WeightFunctionBase):
         WeightFunctionBase.__init__(self, rig)
         self.sym = sym
 
-    def call(self, otherSym):
-        if otherSym[1] == self.sym:
-            return (0, otherSym[0])
+    def call(self, c, pos):
+        if c == self.sym:
+            return (0, pos)
         else:
             return self.rig.zero
 
+    def literal(self):
+        return self.sym
+
+    def key(self):
+        return "p%d" % self.sym
+
 def createStartPositionMatcher(sym, rig):
     return StartPositionMatcher(sym, rig)
 
@@ -84,12 +101,18 @@ class StartEndPositionMatcher(WeightFunctionBase):
             WeightFunctionBase.__init__(self, rig)
             self.sym = sym
 
-        def call(self, otherSym):
-            if otherSym[1] == self.sym:
-                return (otherSym[0], otherSym[0])
+        def call(self, c, pos):
+            if c == self.sym:
+                return (pos, pos)
             else:
                 return self.rig.zero
 
+        def literal(self):
+            return self.sym
+
+        def key(self):
+            return "r%d" % self.sym
+
 def createStartEndPositionMatcher(sym, rig):
     return StartEndPositionMatcher(sym, rig)
 
@@ -101,24 +124,14 @@ class CaseInsensitiveWrapper(WeightFunctionBase):
         WeightFunctionBase.__init__(self, rig)
         self.base = base
 
-    @extractSym
-    def call(self, sym):
-        return self.base.call((0, ord(chr(sym).lower())))
+    def call(self, c, pos):
+        return self.base.call(ord(chr(c).lower()), pos)
 
-class InvertWrapper(WeightFunctionBase):
-    """ Takes a weight function and inverts it; that is, if a zero is returned
-        originally, return a one; otherwise return a zero """
-    _imutable_fields_ = ["base"]
-
-    def __init__(self, base, rig):
-        WeightFunctionBase.__init__(self, rig)
-        self.base = base
-
-    def call(self, sym):
-        if self.base.call(sym) == self.rig.zero:
-            return self.rig.one
-        else:
-            return self.rig.zero
+    def key(self):
+        base = self.base.key()
+        if base == "":
+            return ""
+        return "i" + base
 
 class AllButNewLineMatcher(WeightFunctionBase):
     """ Returns a "match" (as defined by the rig) unless the symbol is a newline"""
@@ -126,24 +139,33 @@ class AllButNewLineMatcher(WeightFunctionBase):
     def __init__(self, rig):
         WeightFunctionBase.__init__(self, rig)
 
-    def call(self, sym):
-        if sym[1] == 10:  # ord(\n) == 10
+    def call(self, c, pos):
+        if c == 10:  # ord(\n) == 10
             return self.rig.zero
         else:
-            return self.rig.autoMatch(sym)
+            return self.rig.autoMatch(pos)
+
+    def key(self):
+        return "."
 
 class OneProducer(WeightFunctionBase):
     """ Always returns a one """
     def __init__(self, rig):
         WeightFunctionBase.__init__(self, rig)
 
-    def call(self, sym):
+    def call(self, c, pos):
         return self.rig.one
 
+    def key(self):
+        return "1"
+
 class ZeroProducer(WeightFunctionBase):
     """ Always returns a zero """
     def __init__(self, rig):
         WeightFunctionBase.__init__(self, rig)
 
-    def call(self, sym):
+    def call(self, c, pos):
         return self.rig.zero
+
+    def key(self):
+        return "0"
@@ -4,13 +4,17 @@
 
 class Expr(object):
     """ Abstract base class """
-    _imutable_fields_ = ["rig"]
+    # children is only set by SeqN and AltN, but the walkers read it through
+    # Expr, so that is where the annotator puts the field
+    _immutable_fields_ = ["_rig", "children[*]"]
 
     def __init__(self, rig):
         """ rig is a semiring with zero, one, plus and mult """
         self._rig = rig
         self._final = self._rig.zero
         self._empty = self._rig.zero
+        self._active = False
+        self._wasActive = False  # Whether it was active at the last updateFinal
 
     def final(self):
         """ Returns the weight of the current symbol after being
@@ -22,6 +26,14 @@ class Expr(object):
     def reset(self):
         """ Resets the regular expressions """
         self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
+
+    def isActive(self):
+        """ Returns whether any mark in the expression is non-zero. A
+            zero mark shifted into an inactive expression leaves it
+            unchanged, so shifting it can be skipped """
+        return self._active
 
     def empty(self):
         """ Returns the weight of the empty string for
@@ -41,8 +53,11 @@ class Sym(Expr):
         self.mark = self._rig.zero
         self.tag = tag
 
-    def shift(self, mark, symbol):
-        self.mark = self._rig.mult(mark, self.weightFunction.call(symbol))
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        self.mark = self._rig.mult(mark, self.weightFunction.call(c, pos))
+        self._active = self.mark != self._rig.zero
 
     def updateFinal(self):
         self._final = self.mark
@@ -54,6 +69,8 @@ class Sym(Expr):
     def reset(self):
         self._final = self._rig.zero
         self.mark = self._rig.zero
+        self._active = False
+        self._wasActive = False
 
 
 class Eps(Expr):
@@ -64,7 +81,7 @@ class Eps(Expr):
         Expr.__init__(self, rig)
         self._empty = self._rig.one
 
-    def shift(self, mark, symbol):
+    def shift(self, mark, c, pos):
         return self
 
     def updateFinal(self):
@@ -83,10 +100,16 @@ class Rep(Expr):
         self.exp = exp
         self._empty = self._rig.one
 
-    def shift(self, mark, symbol):
-        self.exp.shift(self._rig.plus(mark, self._final), symbol)
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        self.exp.shift(self._rig.plus(mark, self._final), c, pos)
+        self._active = self.exp.isActive()
 
     def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
         self._final = self.exp.updateFinal()
         return self._final
 
@@ -96,6 +119,8 @@ class Rep(Expr):
     def reset(self):
         self.exp.reset()
         self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
 
 class Plus(Expr):
     """ exp repeated one or more times """
@@ -106,10 +131,16 @@ class Plus(Expr):
         self.exp = exp
         self._empty = self.exp.empty()
 
-    def shift(self, mark, symbol):
-        self.exp.shift(self._rig.plus(mark, self._final), symbol)
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        self.exp.shift(self._rig.plus(mark, self._final), c, pos)
+        self._active = self.exp.isActive()
 
     def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
         self._final = self.exp.updateFinal()
         return self._final
 
@@ -119,6 +150,8 @@ class Plus(Expr):
     def reset(self):
         self.exp.reset()
         self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
 
 class Question(Expr):
     """ exp 1 or 0 times """
@@ -129,10 +162,16 @@ class Question(Expr):
         self.exp = exp
         self._empty = self._rig.one
 
-    def shift(self, mark, symbol):
-        self.exp.shift(mark, symbol)
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        self.exp.shift(mark, c, pos)
+        self._active = self.exp.isActive()
 
     def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
         self._final = self.exp.updateFinal()
         return self._final
 
@@ -142,6 +181,8 @@ class Question(Expr):
     def reset(self):
         self.exp.reset()
         self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
 
 class Branch(Expr):
     """ A superclass for binary operators """
@@ -157,6 +198,8 @@ class Branch(Expr):
         self.left.reset()
         self.right.reset()
         self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
 
 class Seq(Branch):
     """ Concatanation: match left and right """
@@ -165,14 +208,19 @@ class Seq(Branch):
         Branch.__init__(self, left, right, rig)
         self._empty = self._rig.mult(self.left.empty(), self.right.empty())
 
-    def shift(self, mark, symbol):
-    #    print(symbol)
-        self.left.shift(mark, symbol)
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        self.left.shift(mark, c, pos)
         self.right.shift(self._rig.plus(
                          self._rig.mult(mark, self.left.empty()),
-                         self.left.final()), symbol)
+                         self.left.final()), c, pos)
+        self._active = self.left.isActive() or self.right.isActive()
 
     def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
         l = self.left.updateFinal()
         r = self.right.updateFinal()
         self._final = self._rig.plus(self._rig.mult(l, self.right.empty()), r)
@@ -188,11 +236,17 @@ class Alt(Branch):
         Branch.__init__(self, left, right, rig)
         self._empty = self._rig.plus(self.left.empty(), self.right.empty())
 
-    def shift(self, mark, symbol):
-        self.left.shift(mark, symbol)
-        self.right.shift(mark, symbol)
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        self.left.shift(mark, c, pos)
+        self.right.shift(mark, c, pos)
+        self._active = self.left.isActive() or self.right.isActive()
 
     def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
         l = self.left.updateFinal()
         r = self.right.updateFinal()
         self._final = self._rig.plus(l, r)
@@ -200,3 +254,216 @@ class Alt(Branch):
 
     def copy(self):
         return Alt(self.left.copy(), self.right.copy(), self._rig)
+
+class SeqN(Expr):
+    """ Concatenation of any number of children. Gives the same weights as
+        a chain of Seqs nested to the left, but loops over the children
+        rather than recursing down the chain """
+
+    def __init__(self, children, rig):
+        Expr.__init__(self, rig)
+        self.children = children[:]  # callers build theirs with append
+        self._empty = self._rig.one
+        for child in children:
+            self._empty = self._rig.mult(self._empty, child.empty())
+
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        carried = mark  # mark times the empty weight of the children so far
+        prefixFinal = self._rig.zero  # The final weight of the children so far
+        active = False
+        for child in self.children:
+            m = self._rig.plus(carried, prefixFinal)
+            e = child.empty()
+            prefixFinal = self._rig.plus(self._rig.mult(prefixFinal, e), child.final())
+            carried = self._rig.mult(carried, e)
+            child.shift(m, c, pos)
+            active = active or child.isActive()
+        self._active = active
+
+    def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
+        f = self._rig.zero
+        for child in self.children:
+            f = self._rig.plus(self._rig.mult(f, child.empty()), child.updateFinal())
+        self._final = f
+        return self._final
+
+    def copy(self):
+        return SeqN([child.copy() for child in self.children], self._rig)
+
+    def reset(self):
+        for child in self.children:
+            child.reset()
+        self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
+
+class AltN(Expr):
+    """ Alternation of any number of children """
+
+    def __init__(self, children, rig):
+        Expr.__init__(self, rig)
+        self.children = children[:]  # callers build theirs with append
+        for child in children:
+            self._empty = self._rig.plus(self._empty, child.empty())
+
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        active = False
+        for child in self.children:
+            child.shift(mark, c, pos)
+            active = active or child.isActive()
+        self._active = active
+
+    def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
+        f = self._rig.zero
+        for child in self.children:
+            f = self._rig.plus(f, child.updateFinal())
+        self._final = f
+        return self._final
+
+    def copy(self):
+        return AltN([child.copy() for child in self.children], self._rig)
+
+    def reset(self):
+        for child in self.children:
+            child.reset()
+        self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
+
+class Count(Expr):
+    """ Counted repetition: exp repeated between low and high times. Works
+        out the same weights as the chain of Seqs exp{low} (exp?){high-low},
+        but copies of exp are only made once a mark reaches them """
+
+    _imutable_fields_ = ["rig", "_empty", "exp", "low", "high", "tailEmpty[*]"]
+    def __init__(self, exp, low, high, rig):
+        Expr.__init__(self, rig)
+        self.exp = exp
+        self.low = low
+        self.high = high
+        self.copies = []
+
+        # tailEmpty[k] is the empty weight of the copies from k on
+        self.tailEmpty = [self._rig.one] * (high + 1)
+        for k in range(high - 1, -1, -1):
+            self.tailEmpty[k] = self._rig.mult(self.copyEmpty(k), self.tailEmpty[k + 1])
+        self._empty = self.tailEmpty[0]
+
+    def copyEmpty(self, k):
+        """ The empty weight of copy k: the copies after low are optional """
+        if k >= self.low:
+            return self._rig.one
+        return self.exp.empty()
+
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        carried = mark  # mark times the empty weight of the copies so far
+        prefixFinal = self._rig.zero  # The final weight of the copies so far
+        active = False
+        for k in range(self.high):
+            m = self._rig.plus(carried, prefixFinal)
+            if k == len(self.copies):
+                if m == self._rig.zero:
+                    break  # No mark can reach the copies not yet made
+                self.copies.append(self.exp.copy())
+
+            e = self.copyEmpty(k)
+            prefixFinal = self._rig.plus(self._rig.mult(prefixFinal, e), self.copies[k].final())
+            carried = self._rig.mult(carried, e)
+            self.copies[k].shift(m, c, pos)
+            active = active or self.copies[k].isActive()
+        self._active = active
+
+    def updateFinal(self):
+        if not self._active and not self._wasActive:
+            return self._final  # Zero, as are the finals below
+        self._wasActive = self._active
+        f = self._rig.zero
+        for k in range(len(self.copies)):
+            f = self._rig.plus(self._rig.mult(f, self.copyEmpty(k)), self.copies[k].updateFinal())
+        self._final = self._rig.mult(f, self.tailEmpty[len(self.copies)])
+        return self._final
+
+    def copy(self):
+        return Count(self.exp.copy(), self.low, self.high, self._rig)
+
+    def reset(self):
+        for c in self.copies:
+            c.reset()
+        self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
+
+class SymCount(Count):
+    """ Counted repetition of a single Sym. Each copy is just a mark, so the
+        copies are a shift register, and the weight of each symbol is only
+        worked out once per shift """
+
+    _imutable_fields_ = ["weightFunction"]
+    def __init__(self, exp, low, high, rig):
+        Count.__init__(self, exp, low, high, rig)
+        assert isinstance(exp, Sym)
+        self.weightFunction = exp.weightFunction
+        self.marks = [self._rig.zero] * high
+        self.top = 0  # The marks from top on are all zero
+
+    def shift(self, mark, c, pos):
+        if mark == self._rig.zero and not self._active:
+            return
+        w = self.weightFunction.call(c, pos)
+        carried = mark
+        prefixFinal = self._rig.zero
+        top = 0
+        for k in range(self.high):
+            m = self._rig.plus(carried, prefixFinal)
+            if k >= self.top and m == self._rig.zero:
+                break
+
+            e = self.copyEmpty(k)
+            prefixFinal = self._rig.plus(self._rig.mult(prefixFinal, e), self.marks[k])
+            carried = self._rig.mult(carried, e)
+            self.marks[k] = self._rig.mult(m, w)
+            if self.marks[k] != self._rig.zero:
+                top = k + 1
+        self.top = top
+        self._active = top > 0
+
+    def updateFinal(self):
+        f = self._rig.zero
+        for k in range(self.top):
+            f = self._rig.plus(self._rig.mult(f, self.copyEmpty(k)), self.marks[k])
+        self._final = self._rig.mult(f, self.tailEmpty[self.top])
+        return self._final
+
+    def copy(self):
+        return SymCount(self.exp.copy(), self.low, self.high, self._rig)
+
+    def reset(self):
+        for k in range(self.top):
+            self.marks[k] = self._rig.zero
+        self.top = 0
+        self._final = self._rig.zero
+        self._active = False
+        self._wasActive = False
+
+def createCount(exp, low, high, rig):
+    """ Returns a tree matching exp repeated between low and high times """
+    if high == 0:
+        return Eps(rig)
+    elif low == 1 and high == 1:
+        return exp
+    elif isinstance(exp, Sym):
+        return SymCount(exp, low, high, rig)
+    else:
+        return Count(exp, low, high, rig)
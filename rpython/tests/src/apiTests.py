@@ -0,0 +1,84 @@
+# Checks the library interface in api.py against the command line, and
+# against Python's re where their matches agree.
+
+import random
+import re
+
+from testTools import TestFailure, output
+import api
+import search
+
+def checkApi(tests):
+    """ Runs every test through one api.Pattern for each valid pattern,
+        checking each method against the mode it's built on, returning
+        the number of answers checked """
+    patterns = {}
+    checked = 0
+    for test in tests:
+        regex = test[0]
+        string = test[1]
+        answers = [output([regex, string, str(mode), "stringMode"])[len(regex) + 1:-1] for mode in range(search.nModes)]
+        if answers[0].endswith("Syntax error"):
+            continue
+        if regex not in patterns:
+            patterns[regex] = api.compile(regex)
+        p = patterns[regex]
+
+        start, end = eval(answers[search.FIND_LEFTMOST_RANGE])
+        expected = {
+            "search": None if start < 0 else (start, end + 1),
+            "match": None if start != 0 else (start, end + 1),
+            "fullmatch": (0, len(string)) if answers[search.COMPLETE_MATCH] == "True" else None,
+            "finditer": [(a, b + 1) for a, b in eval(answers[search.FIND_ALL]) if a >= 0],
+        }
+        expected["findall"] = [string[a:b] for a, b in expected["finditer"]]
+        results = {
+            "search": p.search(string),
+            "match": p.match(string),
+            "fullmatch": p.fullmatch(string),
+            "finditer": [m.span() for m in p.finditer(string)],
+            "findall": p.findall(string),
+        }
+        for method in ["search", "match", "fullmatch"]:
+            if results[method] is not None:
+                results[method] = results[method].span()
+        for method in sorted(results):
+            if results[method] != expected[method]:
+                print(test)
+                print("api %s: %r, expected %r" % (method, results[method], expected[method]))
+                raise TestFailure()
+            checked += 1
+    return checked
+
+
+def checkRe():
+    """ Checks api against Python's re, with and without pos and endpos, on
+        random patterns whose leftmost longest and leftmost first matches
+        are the same: a run of single bytes or classes, only the last of
+        which is repeated. Returns the number of answers checked """
+    rnd = random.Random(0)
+    atoms = ["a", "b", "[ab]", "[^a]", "\\d", "."]
+    repeats = ["", "+", "{1,2}", "{2}"]
+    checked = 0
+    for n in range(200):
+        regex = "".join([rnd.choice(atoms) for k in range(rnd.randint(0, 2))])
+        regex += rnd.choice(atoms) + rnd.choice(repeats)
+        flags = rnd.choice([0, api.I])
+        p = api.compile(regex, flags)
+        r = re.compile(regex, re.I if flags else 0)
+        whole = re.compile("(?:%s)\\Z" % regex, re.I if flags else 0)
+        for k in range(5):
+            string = "".join([rnd.choice("aAb1\n") for j in range(rnd.randint(0, 10))])
+            pos = rnd.randint(0, len(string))
+            endpos = rnd.randint(pos, len(string) + 1)
+            for args in [(string,), (string, pos), (string, pos, endpos)]:
+                results = [p.search(*args), p.match(*args), p.fullmatch(*args)]
+                expected = [r.search(*args), r.match(*args), whole.match(*args)]
+                results = [m and m.span() for m in results] + [[m.span() for m in p.finditer(*args)], p.findall(*args)]
+                expected = [m and m.span() for m in expected] + [[m.span() for m in r.finditer(*args)], r.findall(*args)]
+                if results != expected:
+                    print((regex, flags) + args)
+                    print("api: %r, expected %r" % (results, expected))
+                    raise TestFailure()
+                checked += len(results)
+    return checked
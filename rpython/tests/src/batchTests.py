@@ -0,0 +1,82 @@
+# Checks that the records of --batch, and the lines --lines finds with
+# each of -c, -l and -n, agree with the command line.
+
+from testTools import TestFailure, TempFile, output
+import main
+import compiled
+import search
+import inputs
+import batch
+
+def checkBatch(tests):
+    """ Runs the strings for each valid pattern through runBatch in every
+        mode, as lines read in large and small chunks and as frames,
+        returning the number of answers checked """
+    strings = {}
+    for test in tests:
+        if "Syntax error" not in output([test[0], test[1], "0", "stringMode"]):
+            strings.setdefault(test[0], []).append(test[1])
+
+    checked = 0
+    options = compiled.Options()
+    for regex in sorted(strings):
+        for framed, chunkSize in [(False, inputs.DEFAULT_CHUNK_SIZE), (False, 3), (True, inputs.DEFAULT_CHUNK_SIZE)]:
+            records = strings[regex]
+            if framed:
+                data = "".join(["%d\n%s" % (len(r), r) for r in records])
+            else:
+                records = [r for r in records if "\n" not in r]
+                data = "".join([r + "\n" for r in records])
+            options.framed = framed
+            options.chunkSize = chunkSize
+            for mode in range(search.nModes):
+                with TempFile(data) as inFile, TempFile() as outFile:
+                    batch.runBatch(regex, mode, inFile.fd, outFile.fd, options)
+                    answers = outFile.read().split("\n")
+                for k in range(len(records)):
+                    expected = output([regex, records[k], str(mode), "stringMode"]).split("\n")[-2]
+                    if answers[k] != expected:
+                        print((regex, records[k]))
+                        print("Mode %d, batch: %r, expected %r" % (mode, answers[k], expected))
+                        raise TestFailure()
+                    checked += 1
+                if answers[len(records):] != [""]:
+                    raise TestFailure()
+    return checked
+
+
+def checkLines(tests):
+    """ Greps the one-line strings for each valid pattern as the lines of
+        one input, with and without the prefilter and skipping, and read a
+        few bytes at a time, returning
+        the number of answers checked """
+    strings = {}
+    for test in tests:
+        if "\n" not in test[1] and "Syntax error" not in output([test[0], test[1], "0", "stringMode"]):
+            strings.setdefault(test[0], []).append(test[1])
+
+    checked = 0
+    for regex in sorted(strings):
+        lines = strings[regex]
+        s = "".join([line + "\n" for line in lines])
+        numbers = [k + 1 for k in range(len(lines))
+                   if output([regex, lines[k], "0", "stringMode"]).split("\n")[-2] == "True"]
+        expected = {
+            "": "".join([lines[k - 1] + "\n" for k in numbers]),
+            "-n": "".join(["%d:%s\n" % (k, lines[k - 1]) for k in numbers]),
+            "-c": "%d\n" % len(numbers),
+            "-l": "input\n" if numbers else "",
+            "-c -l": "input\n" if numbers else "",
+        }
+        for flag in sorted(expected):
+            for extra in [[], ["--no-prefilter"], ["--no-skip"], ["--chunk-size=3"]]:
+                options, _ = main.parseOptions(["main", "--lines"] + flag.split() + extra)
+                with TempFile(s) as inFile, TempFile() as outFile:
+                    batch.grepLines(regex, inFile.fd, "input", outFile.fd, options)
+                    result = outFile.read()
+                if result != expected[flag]:
+                    print((regex, lines))
+                    print("--lines %s: %r, expected %r" % (" ".join([flag] + extra), result, expected[flag]))
+                    raise TestFailure()
+                checked += 1
+    return checked
@@ -0,0 +1,138 @@
+# Checks that trees reused from a PatternCache, loaded from an image
+# written by --write-image, or built into a catalogue as the target
+# builds them, give the same answers as trees parsed afresh.
+
+from testTools import TestFailure, TempFile, output
+import main
+import compiled
+import search
+
+def checkCache(tests):
+    """ Runs every test in every mode, with several sets of options,
+        through one small PatternCache, so that trees are both reused and
+        evicted, returning the number of answers checked """
+    optionSets = [main.parseOptions(["main"] + args + ["re"])[0]
+                  for args in [[], ["--engine=dfa"], ["--no-simplify"], ["--no-skip"]]]
+    cache = compiled.PatternCache(4)
+    checked = 0
+    for test in tests:
+        for mode in range(search.nModes):
+            expected = output([test[0], test[1], str(mode), "stringMode"])[len(test[0]) + 1:-1]
+            if expected.endswith("Syntax error"):
+                continue
+            for options in optionSets:
+                result = compiled.Compiled(test[0], mode, options, cache).answer(test[1], -1)
+                if result != expected:
+                    print(test)
+                    print("Mode %d, cached: %r, expected %r" % (mode, result, expected))
+                    raise TestFailure()
+                checked += 1
+    if cache.hits == 0 or cache.evictions == 0:
+        print(cache.stats())
+        raise TestFailure()
+    return checked
+
+
+def notCalled(*args):
+    raise TestFailure()
+
+
+def validPatterns(tests):
+    """ The distinct patterns of tests which compile and fit on a line """
+    patterns = []
+    for test in tests:
+        if "\n" not in test[0] and test[0] not in patterns and \
+                "Syntax error" not in output([test[0], test[1], "0", "stringMode"]):
+            patterns.append(test[0])
+    return patterns
+
+
+def checkImage(tests):
+    """ Writes the valid patterns to an image with and without simplifying,
+        then runs every test in every mode with the image, with and without
+        simplifying, each run with an empty cache. A pattern is only parsed
+        if the image was written with other options, in which case each of
+        its trees is. Returns the number of answers checked """
+    patterns = validPatterns(tests)
+    settings = [[], ["--no-simplify"]]
+    checked = 0
+    compileRegex = compiled.compileRegex
+    parsed = []
+
+    def countParsed(re, rig, matchFunction):
+        parsed.append(re)
+        return compileRegex(re, rig, matchFunction)
+
+    with TempFile("".join([p + "\n" for p in patterns])) as patternsFile, TempFile() as imageFile:
+        for written in settings:
+            if output(written + ["--write-image=" + imageFile.path, patternsFile.path]) != "%d\n" % len(patterns):
+                raise TestFailure()
+            for loaded in settings:
+                for test in tests:
+                    if test[0] not in patterns:
+                        continue
+                    for mode in range(search.nModes):
+                        expected = output(loaded + [test[0], test[1], str(mode), "stringMode"])
+                        compiled.processCache = compiled.PatternCache(compiled.DEFAULT_CAPACITY)
+                        compiled.compileRegex = notCalled
+                        if loaded != written:
+                            compiled.compileRegex = countParsed
+                        del parsed[:]
+                        try:
+                            result = output(loaded + ["--image=" + imageFile.path, test[0], test[1], str(mode), "stringMode"])
+                        finally:
+                            compiled.compileRegex = compileRegex
+                        if result != expected or (loaded != written and not parsed):
+                            print(test)
+                            print("Mode %d, from image written with %r, run with %r: %r, expected %r, parsed %r" % (
+                                mode, written, loaded, result, expected, parsed))
+                            raise TestFailure()
+                        checked += 1
+    return checked
+
+
+def checkCatalogue(tests):
+    """ Builds a catalogue of the valid patterns, then runs every test in
+        every mode with its pattern given by name, with and without
+        simplifying, each run with an empty cache. With the settings the
+        catalogue was built with, no pattern is parsed, analysed or given
+        a RangeFinder; without them, each is parsed. Returns the number of
+        answers checked """
+    patterns = validPatterns(tests)
+    checked = 0
+    saved = (compiled.compileRegex, compiled.buildPrefilter, compiled.buildStartSet, compiled.buildRangeFinder)
+    parsed = []
+
+    def countParsed(re, rig, matchFunction):
+        parsed.append(re)
+        return saved[0](re, rig, matchFunction)
+
+    with TempFile("".join(["p%d %s\n" % (k, patterns[k]) for k in range(len(patterns))])) as catalogueFile:
+        try:
+            compiled.buildCatalogue(catalogueFile.path)
+            for test in tests:
+                if test[0] not in patterns:
+                    continue
+                name = "p%d" % patterns.index(test[0])
+                for mode in range(search.nModes):
+                    for settings in [[], ["--no-simplify"]]:
+                        expected = output(settings + [test[0], test[1], str(mode), "stringMode"])[len(test[0]):]
+                        compiled.processCache = compiled.PatternCache(compiled.DEFAULT_CAPACITY)
+                        del parsed[:]
+                        if settings:
+                            compiled.compileRegex = countParsed
+                        else:
+                            compiled.compileRegex = compiled.buildPrefilter = compiled.buildStartSet = compiled.buildRangeFinder = notCalled
+                        try:
+                            result = output(settings + ["--named", name, test[1], str(mode), "stringMode"])[len(name):]
+                        finally:
+                            compiled.compileRegex, compiled.buildPrefilter, compiled.buildStartSet, compiled.buildRangeFinder = saved
+                        if result != expected or (settings and not parsed):
+                            print(test)
+                            print("Mode %d, from catalogue with %r: %r, expected %r, parsed %r" % (
+                                mode, settings, result, expected, parsed))
+                            raise TestFailure()
+                        checked += 1
+        finally:
+            compiled.catalogue = compiled.Catalogue()
+    return checked
@@ -0,0 +1,40 @@
+# Runs the engine tests on reTests.py, each module checking one feature
+# against the tree run in stringMode:
+#   searchTests: each engine and configuration, large patterns, sets,
+#     streams, files and workers which fail
+#   cacheTests: the pattern cache, images and catalogues
+#   apiTests: api.py, against the command line and Python's re
+#   serveTests: --serve, over a stream and a socket
+#   batchTests: --batch and --lines
+# Run from the rpython directory.
+
+from reTests import *
+from searchTests import checkEngines, checkLarge, checkStream, checkSets, checkFiles, checkFailedWorkers
+from cacheTests import checkCache, checkImage, checkCatalogue
+from apiTests import checkApi, checkRe
+from serveTests import checkServe, checkServeErrors, checkSocket
+from batchTests import checkBatch, checkLines
+
+
+if __name__ == '__main__':
+    testsPassed = 0
+
+    for test in tests:
+        testsPassed += checkEngines(test)
+        testsPassed += checkStream(test)
+
+    testsPassed += checkLarge()
+    testsPassed += checkSets(tests)
+    testsPassed += checkFiles(tests)
+    testsPassed += checkFailedWorkers()
+    testsPassed += checkCache(tests)
+    testsPassed += checkImage(tests)
+    testsPassed += checkCatalogue(tests)
+    testsPassed += checkApi(tests)
+    testsPassed += checkRe()
+    testsPassed += checkServe(tests)
+    testsPassed += checkServeErrors()
+    testsPassed += checkSocket(tests)
+    testsPassed += checkBatch(tests)
+    testsPassed += checkLines(tests)
+    print("\nALL %d TESTS PASSED\n" % testsPassed)
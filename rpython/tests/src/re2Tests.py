@@ -1,18 +1,23 @@
+import mmap
 import os
 import sys
 import re2
 
 
 def readFile(filename):
+    """ Returns the contents of a file, copied out of a memory map in one
+        go, as re2 wants a str """
     fp = os.open(filename, os.O_RDONLY, 0777)
-    f = ""
-    while True:
-        read = os.read(fp, 4096)
-        if len(read) == 0:
-            break
-        f += read
-    os.close(fp)
-    return f
+    try:
+        if os.fstat(fp).st_size == 0:
+            return ""  # An empty file can't be mapped
+        m = mmap.mmap(fp, 0, access=mmap.ACCESS_READ)
+        try:
+            return m[:]
+        finally:
+            m.close()
+    finally:
+        os.close(fp)
 
 if __name__ == '__main__':
     try:
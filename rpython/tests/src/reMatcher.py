@@ -1,17 +1,18 @@
+import mmap
 import os
 import sys
 import re
 
 def readFile(filename):
+    """ Returns a read-only memory map of a file, which re searches in
+        place """
     fp = os.open(filename, os.O_RDONLY, 0777)
-    f = ""
-    while True:
-        read = os.read(fp, 4096)
-        if len(read) == 0:
-            break
-        f += read
-    os.close(fp)
-    return f
+    try:
+        if os.fstat(fp).st_size == 0:
+            return ""  # An empty file can't be mapped
+        return mmap.mmap(fp, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fp)
 
 if __name__ == '__main__':
     try:
@@ -167,6 +167,8 @@ tests = [
 #    ('\\By\\B', 'xyz', SUCCEED, '"-"', '-'),
     ('ab|cd', 'abc', SUCCEED, 'found', 'ab'),
     ('ab|cd', 'abcd', SUCCEED, 'found', 'ab'),
+    ('abcd|c', 'xabcd', SUCCEED, 'found', 'abcd'),
+    ('ab|bcde', 'abcde', SUCCEED, 'found', 'ab'),
     ('()ef', 'def', SUCCEED, 'found+"-"+g1', 'ef-'),
 #    ('$b', 'b', FAIL),
     ('a\\(b', 'a(b', SUCCEED, 'found+"-"+g1', 'a(b-Error'),
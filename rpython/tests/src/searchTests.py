@@ -0,0 +1,187 @@
+# Checks that each engine and configuration, patterns too large to
+# analyse, patterns run as a set, strings streamed in small chunks and
+# directories of files searched by worker processes, give the same
+# answers as the tree on reTests.py, and the same again when the workers
+# fail.
+
+import os
+import shutil
+import tempfile
+
+from testTools import TestFailure, TempFile, output
+import compiled
+import search
+import parallel
+import files
+
+chunkSizes = [1, 3]
+configurations = [["--engine=glushkov"], ["--engine=shiftand"], ["--engine=dfa"],
+                  ["--no-prefilter"], ["--no-skip"], ["--no-reverse"],
+                  ["--no-simplify"], ["--jobs=3"]]
+
+
+def checkEngines(test):
+    """ Runs a test in every mode with each of the configurations,
+        returning the number of answers checked """
+    checked = 0
+    for mode in range(search.nModes):
+        expected = output([test[0], test[1], str(mode), "stringMode"])
+        for options in configurations:
+            result = output(options + [test[0], test[1], str(mode), "stringMode"])
+            if result != expected:
+                print(test)
+                print("Mode %d, %s: %r, expected %r" % (mode, " ".join(options), result, expected))
+                raise TestFailure()
+            checked += 1
+    return checked
+
+
+def checkLarge():
+    """ Runs patterns whose automata are too large to build for a
+        RangeFinder, and one repeated too often to unroll for its
+        literals, in every mode, with and without the analyses, returning
+        the number of answers checked """
+    tooLarge = [("a{0,800}b", "xxaab"), ("(ab|c){0,300}d", "cabd"),
+                ("xa{2,500}y", "x" + "a" * 600 + "y" + "xaaay")]
+    plain = ["--no-prefilter", "--no-skip", "--no-reverse"]
+    checked = 0
+    for test in tooLarge:
+        if compiled.Compiled(test[0], search.FIND_LEFTMOST_RANGE, compiled.Options(), compiled.createCache(compiled.Options())).finderPattern is not None:
+            print(test)
+            print("Built a RangeFinder over MAX_SIZE")
+            raise TestFailure()
+    for test in tooLarge + [("(abc){2,100}z", "ab" + "abc" * 5 + "z")]:
+        for mode in range(search.nModes):
+            expected = output(plain + [test[0], test[1], str(mode), "stringMode"])
+            for options in [[], ["--jobs=3"]]:
+                result = output(options + [test[0], test[1], str(mode), "stringMode"])
+                if result != expected:
+                    print(test)
+                    print("Mode %d, %s: %r, expected %r" % (mode, " ".join(options), result, expected))
+                    raise TestFailure()
+                checked += 1
+    return checked
+
+
+def checkStream(test):
+    """ Streams the string of a test from a file in every mode, returning
+        the number of answers checked """
+    checked = 0
+    with TempFile(test[1]) as stringFile:
+        for mode in range(search.nModes):
+            expected = output([test[0], test[1], str(mode), "stringMode"])
+            for size in chunkSizes:
+                options = ["--stream", "--chunk-size=%d" % size]
+                result = output(options + [test[0], stringFile.path, str(mode)])
+                if result != expected:
+                    print(test)
+                    print("Mode %d, %s: %r, expected %r" % (mode, " ".join(options), result, expected))
+                    raise TestFailure()
+                checked += 1
+    return checked
+
+
+def checkSets(tests):
+    """ Runs the valid patterns for each string as a set, in every mode,
+        returning the number of answers checked """
+    patterns = {}
+    for test in tests:
+        if "\n" not in test[0] and "Syntax error" not in output([test[0], test[1], "0", "stringMode"]):
+            patterns.setdefault(test[1], []).append(test[0])
+
+    checked = 0
+    for string in sorted(patterns):
+        with TempFile("\n".join(patterns[string]) + "\n") as patternsFile:
+            for mode in range(search.nModes):
+                lines = output(["--patterns", patternsFile.path, string, str(mode), "stringMode"]).split("\n")[1:]
+                for k in range(len(patterns[string])):
+                    regex = patterns[string][k]
+                    expected = output([regex, string, str(mode), "stringMode"]).split("\n")[1]
+                    if lines[k] != "%d %s" % (k, expected):
+                        print((regex, string))
+                        print("Mode %d, --patterns: %r, expected %r" % (mode, lines[k], expected))
+                        raise TestFailure()
+                    checked += 1
+    return checked
+
+
+def checkFiles(tests):
+    """ Writes the strings for each valid pattern to a directory and runs
+        the pattern over it, in every mode, returning the number of answers
+        checked """
+    strings = {}
+    for test in tests:
+        if "\n" not in test[0] and "Syntax error" not in output([test[0], test[1], "0", "stringMode"]):
+            strings.setdefault(test[0], []).append(test[1])
+
+    checked = 0
+    for regex in sorted(strings):
+        directory = tempfile.mkdtemp()
+        try:
+            paths = []
+            for k in range(len(strings[regex])):
+                paths.append(os.path.join(directory, "%03d" % k))
+                f = open(paths[k], "w")
+                f.write(strings[regex][k])
+                f.close()
+            for mode in range(search.nModes):
+                for options in [["--files"], ["--files", "--jobs=2"]]:
+                    lines = output(options + [regex, str(mode), directory]).split("\n")[1:]
+                    for k in range(len(paths)):
+                        expected = output([regex, strings[regex][k], str(mode), "stringMode"]).split("\n")[1]
+                        if lines[k] != "%s: %s" % (paths[k], expected):
+                            print((regex, strings[regex][k]))
+                            print("Mode %d, %s: %r, expected %r" % (mode, " ".join(options), lines[k], expected))
+                            raise TestFailure()
+                        checked += 1
+        finally:
+            shutil.rmtree(directory)
+    return checked
+
+
+def failWorker(fd, results):
+    raise OSError(5, "Worker failed")
+
+
+def checkFailedWorkers():
+    """ Runs FIND_ALL with --jobs over strings cut into several shards, and
+        --files over a directory, with every worker failing, so that the
+        shards and files are all searched again by the parent, returning
+        the number of answers checked """
+    tests = [("ab", "ab cd ab ef ab " * 50), ("a[bc]+d", "abcd x acd y abbd " * 40),
+             ("x(y|z)*w", "xyzw q xw " * 60)]
+    saved = (parallel.sendMatches, files.sendResults)
+    checked = 0
+    for test in tests:
+        expected = output([test[0], test[1], str(search.FIND_ALL), "stringMode"])
+        parallel.sendMatches = failWorker
+        try:
+            result = output(["--jobs=3", test[0], test[1], str(search.FIND_ALL), "stringMode"])
+        finally:
+            parallel.sendMatches = saved[0]
+        if result != expected:
+            print(test)
+            print("--jobs=3 with failed workers: %r, expected %r" % (result, expected))
+            raise TestFailure()
+        checked += 1
+
+    directory = tempfile.mkdtemp()
+    try:
+        for k in range(len(tests)):
+            f = open(os.path.join(directory, "%03d" % k), "w")
+            f.write(tests[k][1])
+            f.close()
+        for mode in range(search.nModes):
+            expected = output(["--files", "ab", str(mode), directory])
+            files.sendResults = failWorker
+            try:
+                result = output(["--files", "--jobs=2", "ab", str(mode), directory])
+            finally:
+                files.sendResults = saved[1]
+            if result != expected:
+                print("Mode %d, --files --jobs=2 with failed workers: %r, expected %r" % (mode, result, expected))
+                raise TestFailure()
+            checked += 1
+    finally:
+        shutil.rmtree(directory)
+    return checked
@@ -0,0 +1,126 @@
+# Checks that --serve answers framed requests as the command line does,
+# over a stream and a Unix socket, and answers bad requests with errors.
+
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from StringIO import StringIO
+
+from testTools import TestFailure, TempFile, output
+import main
+import compiled
+import search
+import serve
+
+def checkServe(tests):
+    """ Sends every test in every mode to serveRequests as one stream of
+        requests, returning the number of answers checked """
+    requests = StringIO()
+    expected = []
+    for test in tests:
+        for mode in range(search.nModes):
+            for field in [test[0], str(mode), "string", test[1]]:
+                requests.write("%d\n%s" % (len(field), field))
+            expected.append(output([test[0], test[1], str(mode), "stringMode"]).split("\n")[-2])
+
+    with TempFile(requests.getvalue()) as inFile, TempFile() as outFile:
+        serve.serveRequests(inFile.fd, outFile.fd, compiled.createCache(compiled.Options()), compiled.Options())
+        os.lseek(outFile.fd, 0, 0)
+        reader = serve.FrameReader(outFile.fd)
+        for k in range(len(expected)):
+            answer = reader.readFrame()
+            if answer != expected[k]:
+                print(tests[k // search.nModes])
+                print("Mode %d, served: %r, expected %r" % (k % search.nModes, answer, expected[k]))
+                raise TestFailure()
+        if reader.readFrame() is not None:
+            raise TestFailure()
+    return len(expected)
+
+
+def request(fields):
+    return "".join(["%d\n%s" % (len(field), field) for field in fields])
+
+
+def checkServeErrors():
+    """ Sends --serve requests which can't be answered, including one for a
+        pattern whose tree in the image is corrupt, returning the number of
+        answers checked """
+    directory = tempfile.mkdtemp()
+    try:
+        imageFile = os.path.join(directory, "image")
+        main.writeImage(["a"], imageFile, compiled.Options())
+        data = open(imageFile, "rb").read()
+        start, end = compiled.PatternImage(data).trees[("a", "bit", "single symbol", compiled.Options().treeKey())]
+        open(imageFile, "wb").write(data[:start] + "\x7f" * (end - start) + data[end:])
+        options = main.parseOptions(["main", "--image=" + imageFile, "re"])[0]
+
+        cases = [(["a(", "0", "string", "a"], "Syntax error"),
+                 (["a", "x", "string", "a"], "Invalid mode option"),
+                 (["a", "9", "string", "a"], "Syntax error"),
+                 (["a", "0", "pipe", "a"], "Unknown input source: pipe"),
+                 (["a", "0", "file", os.path.join(directory, "missing")], "cannot read"),
+                 (["a", "0", "string", "a"], "Invalid weight function in image")]
+        requests = "".join([request(fields) for fields, answer in cases])
+        with TempFile(requests) as inFile, TempFile() as outFile:
+            serve.serveRequests(inFile.fd, outFile.fd, compiled.createCache(options), options)
+            os.lseek(outFile.fd, 0, 0)
+            reader = serve.FrameReader(outFile.fd)
+            for fields, expected in cases:
+                answer = reader.readFrame()
+                if answer != expected:
+                    print("Served %r: %r, expected %r" % (fields, answer, expected))
+                    raise TestFailure()
+    finally:
+        shutil.rmtree(directory)
+    return len(cases)
+
+
+def checkSocket(tests):
+    """ Starts --serve on a Unix socket left behind by an earlier server,
+        and sends it each test in mode FIND_LEFTMOST_RANGE over its own
+        connection, returning the number of answers checked """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "socket")
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            main.entry_point(["main", "--serve", "--socket=" + path])
+        finally:
+            os._exit(1)
+
+    checked = 0
+    try:
+        for test in tests[:50]:
+            expected = output([test[0], test[1], "3", "stringMode"]).split("\n")[-2]
+            client = socket.socket(socket.AF_UNIX)
+            for attempt in range(100):
+                try:
+                    client.connect(path)
+                    break
+                except socket.error:
+                    time.sleep(0.1)  # The server may still be starting
+            client.sendall(request([test[0], "3", "string", test[1]]))
+            answer = ""
+            while True:
+                data = client.recv(1 << 16)
+                if data == "":
+                    break
+                answer += data
+            client.close()
+            if answer != request([expected]):
+                print(test)
+                print("Socket: %r, expected %r" % (answer, request([expected])))
+                raise TestFailure()
+            checked += 1
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        shutil.rmtree(directory)
+    return checked
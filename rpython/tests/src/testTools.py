@@ -0,0 +1,65 @@
+# What the feature tests share: running main as the command line would,
+# and temporary files to feed it. Run from the rpython directory.
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, "src")
+
+import main
+
+class TestFailure(Exception):
+    pass
+
+
+def output(args):
+    """ Runs main with args, returning what it printed or wrote to file
+        descriptor 1, in the order it did so """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    capture = tempfile.TemporaryFile()
+    os.dup2(capture.fileno(), 1)
+    stdout = sys.stdout
+    sys.stdout = os.fdopen(os.dup(1), "w", 0)
+    try:
+        main.entry_point(["main"] + args)
+        capture.seek(0)
+        return capture.read()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.dup2(saved, 1)
+        os.close(saved)
+        capture.close()
+
+
+class TempFile(object):
+    """ A temporary file, open for reading and writing as fd with data
+        written to it and the offset back at the start, which is closed
+        and removed at the end of the with block using it """
+
+    def __init__(self, data=""):
+        self.data = data
+        self.fd = -1
+        self.path = None
+
+    def __enter__(self):
+        self.fd, self.path = tempfile.mkstemp()
+        os.write(self.fd, self.data)
+        os.lseek(self.fd, 0, 0)
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+        os.remove(self.path)
+
+    def read(self):
+        """ Returns everything in the file """
+        os.lseek(self.fd, 0, 0)
+        chunks = []
+        while True:
+            data = os.read(self.fd, 1 << 16)
+            if data == "":
+                return "".join(chunks)
+            chunks.append(data)